@@ -0,0 +1,73 @@
+import datetime
+import types
+
+import pytest
+
+from yandex_disk_rsync import data, transfer
+from yandex_disk_rsync.data import yd_list
+from yandex_disk_rsync.hashing import file_digests
+from yandex_disk_rsync.transfer import upload_file, ydcmd_transfers
+
+
+def test_yd_list_pages(monkeypatch):
+    items = [
+        {'name': f'file{i}', 'type': 'file', 'md5': str(i), 'size': i,
+         'modified': '2022-11-13T13:17:29+00:00'}
+        for i in range(5)
+    ]
+    requests = []
+
+    def api_query(options, method, url, args):
+        requests.append(args)
+        offset, limit = args['offset'], args['limit']
+        return {'name': 'dir', 'type': 'dir', '_embedded': {'items': items[offset:offset + limit]}}
+
+    monkeypatch.setattr(data, 'api_query', api_query)
+    listing = yd_list(types.SimpleNamespace(baseurl='https://api', limit=2), 'disk:/dir')
+
+    assert sorted(listing) == [f'file{i}' for i in range(5)]
+    assert [args['offset'] for args in requests] == [0, 2, 4]
+    assert listing['file3'].md5 == '3'
+    assert listing['file3'].modified == datetime.datetime(2022, 11, 13, 13, 17, 29, tzinfo=datetime.timezone.utc)
+
+
+def test_ydcmd_transfers_only_for_encryption():
+    assert not ydcmd_transfers(types.SimpleNamespace(token='x'))
+    assert not ydcmd_transfers(types.SimpleNamespace(encrypt='no', decrypt=False))
+    assert ydcmd_transfers(types.SimpleNamespace(encrypt=True, decrypt=False))
+    assert ydcmd_transfers(types.SimpleNamespace(encrypt='no', decrypt='yes'))
+
+
+def test_upload_file_hashes_the_stream(monkeypatch, tmp_path):
+    file_path = tmp_path / 'file'
+    file_path.write_bytes(b'content')
+    sent = []
+
+    class Session:
+        def put(self, link, data, **kwargs):
+            sent.append(b''.join(data))
+            return types.SimpleNamespace(raise_for_status=lambda: None)
+
+    monkeypatch.setattr(transfer, 'http_session', Session)
+    monkeypatch.setattr(transfer, '_transfer_link', lambda options, method, path: 'https://upload')
+    options = types.SimpleNamespace(token='x', timeout=1, retries=0, delay=0)
+
+    digests = upload_file(options, file_path, '/disk/file')
+    assert sent == [b'content']
+    assert digests.md5 == file_digests(file_path).md5
+    assert digests.sha256 is None
+
+    digests = upload_file(options, file_path, '/disk/file', algorithms=('md5', 'sha256'))
+    assert digests.sha256 == file_digests(file_path).sha256
+
+
+def test_http_pool_fits_threads(monkeypatch):
+    pytest.importorskip('requests')
+    monkeypatch.setattr(transfer, '_session', None)
+    monkeypatch.setattr(transfer, '_pool_size', transfer.DEFAULT_POOL_SIZE)
+
+    transfer.set_http_pool_size(4)
+    assert transfer.http_session().get_adapter('https://x')._pool_maxsize == transfer.DEFAULT_POOL_SIZE
+
+    transfer.set_http_pool_size(32)
+    assert transfer.http_session().get_adapter('https://x')._pool_maxsize == 33
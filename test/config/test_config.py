@@ -40,3 +40,38 @@ def test_deserialize_yaml_has_unused_fields(config_2_wrong_fields):
         'ydcmd.this_field_does_not_exists',
         'another_unexisting_field'
     }
+
+
+@pytest.fixture
+def config_3_jobs():
+    return Path(__file__).parent / 'test_config_3_jobs.yaml'
+
+
+def test_deserialize_yaml_jobs(config_3_jobs):
+    options = deserialize_yaml(config_3_jobs)
+    assert [job.name for job in options.jobs] == ['photos', 'docs']
+
+    photos, docs = options.jobs
+    assert photos.local_path == Path('/data/photos')
+    assert photos.target == 'disk'
+    assert photos.delete is True
+    assert photos.threads == 8
+    assert docs.delete is False
+
+    unused = ydr_config.Config.get_unused_keys(
+        yaml.safe_load(file_text_read(config_3_jobs)),
+    )
+    assert unused == ['jobs[1].unknown_job_field']
+
+
+def test_ydcmd_config_keys_match_ydcmd():
+    ydcmd = pytest.importorskip('yandex_disk_rsync.ydcmd')
+    assert ydr_config.YDCMD_CONFIG_KEYS == frozenset(ydcmd.yd_default_config().keys())
+
+
+def test_ydcmd_transfer_fields_without_encryption():
+    ignored = getattr(ydr_config, '_get_ydcmd_ignored_fields')
+
+    assert ignored({'token': 'x', 'chunk': 1024, 'ciphers': 'HIGH'}) == ['chunk', 'ciphers']
+    assert ignored({'encrypt': 'yes', 'encrypt-cmd': 'gpg', 'temp-dir': '/tmp'}) == []
+    assert ignored({'decrypt': False, 'temp-dir': '/tmp'}) == ['temp-dir']
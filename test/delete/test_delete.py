@@ -0,0 +1,86 @@
+import threading
+import time
+import types
+from concurrent import futures
+
+from yandex_disk_rsync import data
+from yandex_disk_rsync.data import yd_delete_batch
+
+
+def _options():
+    return types.SimpleNamespace(poll=0, timeout=30, retries=3)
+
+
+def test_yd_delete_batch(monkeypatch):
+    # status sequences of the async operations
+    statuses = {
+        'in-progress': ['in-progress', 'in-progress', 'success'],
+        'failed': ['in-progress', 'failed'],
+    }
+    polled = []
+
+    def delete_request(options, path, permanently):
+        assert permanently
+        if path == 'immediate':
+            return None
+        return {'href': path, 'method': 'GET'}
+
+    def operation_status(options, link):
+        polled.append(link['href'])
+        return statuses[link['href']].pop(0)
+
+    monkeypatch.setattr(data, '_yd_delete_request', delete_request)
+    monkeypatch.setattr(data, '_yd_operation_status', operation_status)
+
+    failed = yd_delete_batch(
+        _options(),
+        ['immediate', 'in-progress', 'failed'],
+        permanently=True,
+        threads=2,
+    )
+
+    assert failed == ['failed']
+    assert polled.count('in-progress') == 3
+    assert polled.count('failed') == 2
+    assert 'immediate' not in polled
+
+
+def test_yd_delete_batch_without_async_operations(monkeypatch):
+    monkeypatch.setattr(data, '_yd_delete_request', lambda options, path, permanently: None)
+    monkeypatch.setattr(data, '_yd_operation_status', None)
+
+    assert yd_delete_batch(_options(), ['a', 'b']) == []
+
+
+def test_yd_delete_batch_limits_shared_pool(monkeypatch):
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def delete_request(options, path, permanently):
+        with lock:
+            running.append(path)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(path)
+        return None
+
+    monkeypatch.setattr(data, '_yd_delete_request', delete_request)
+
+    with futures.ThreadPoolExecutor(8) as executor:
+        paths = [str(i) for i in range(16)]
+        assert yd_delete_batch(_options(), paths, threads=2, executor=executor) == []
+
+    assert len(peak) == 16
+    assert max(peak) <= 2
+
+
+def test_yd_delete_batch_stops_polling_after_timeout(monkeypatch):
+    monkeypatch.setattr(data, '_yd_delete_request',
+                        lambda options, path, permanently: {'href': path, 'method': 'GET'})
+    monkeypatch.setattr(data, '_yd_operation_status',
+                        lambda options, link: 'success' if link['href'] == 'done' else 'in-progress')
+    options = types.SimpleNamespace(poll=0.01, timeout=0.02, retries=1)
+
+    assert yd_delete_batch(options, ['done', 'stuck']) == ['stuck']
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+from pathlib import Path
+
+from yandex_disk_rsync.data import local_digests, local_listdir, Checksum
+from yandex_disk_rsync.hash_cache import HashCache
+from yandex_disk_rsync.hashing import file_digests, Digests
+
+
+def test_hash_cache_invalidation(tmp_path: Path):
+    file_path = tmp_path / 'file'
+    file_path.write_text('content')
+    stat = os.stat(file_path)
+
+    with HashCache(tmp_path / 'cache.sqlite3') as cache:
+        assert cache.get(file_path, stat, ['md5']) is None
+
+        cache.put(file_path, stat, file_digests(file_path, ['md5']))
+        assert cache.get(file_path, stat, ['md5']).md5 == file_digests(file_path).md5
+        assert cache.get(file_path, stat, ['md5', 'sha256']) is None
+
+        file_path.write_text('changed content')
+        assert cache.get(file_path, os.stat(file_path), ['md5']) is None
+
+
+def test_local_listdir_uses_hash_cache(tmp_path: Path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    file_path = root / 'file'
+    file_path.write_text('content')
+
+    with HashCache(tmp_path / 'cache.sqlite3') as cache:
+        first, = local_listdir(None, root, hash_cache=cache)
+        assert first.md5 == file_digests(file_path).md5
+
+        # a stale digest proves the cached value is used
+        cache.put(file_path, os.stat(file_path), Digests(size=7, md5='cached'))
+        second, = local_listdir(None, root, hash_cache=cache)
+        assert second.md5 == 'cached'
+
+        third, = local_listdir(None, root, checksum=Checksum.Sha256, hash_cache=cache)
+        assert third.md5 == first.md5
+        assert third.sha256 == file_digests(file_path).sha256
+
+
+def test_hash_cache_is_shared_between_processes(tmp_path: Path):
+    file_path = tmp_path / 'file'
+    file_path.write_text('content')
+    stat = os.stat(file_path)
+    digests = file_digests(file_path, ['md5'])
+
+    with HashCache(tmp_path / 'cache.sqlite3', timeout=0.1) as first, \
+            HashCache(tmp_path / 'cache.sqlite3', timeout=0.1) as second:
+        first.put(file_path, stat, digests)
+        # committed without closing the first cache
+        assert second.get(file_path, stat, ['md5']) == digests
+
+        locker = sqlite3.connect(str(tmp_path / 'cache.sqlite3'), isolation_level=None)
+        locker.execute('BEGIN EXCLUSIVE')
+        # the locked database is skipped, not failed
+        second.put(file_path, stat, Digests(size=7, md5='other'))
+        second.remove(file_path)
+        locker.execute('ROLLBACK')
+        locker.close()
+
+        assert first.get(file_path, stat, ['md5']) == digests
+
+
+def test_local_listdir_skips_partial_downloads(tmp_path: Path):
+    (tmp_path / 'file').write_text('content')
+    (tmp_path / '.file.ydsync-part').write_text('cont')
+
+    assert [item.path for item in local_listdir(None, tmp_path)] == ['file']
+
+
+def test_local_digests_hashes_only_compared_files(tmp_path: Path):
+    (tmp_path / 'compared').write_text('content')
+    (tmp_path / 'new').write_text('new content')
+
+    listed = {item.path: item for item in local_listdir(None, tmp_path, checksum=Checksum.Size)}
+    assert listed['new'].md5 is None and listed['new'].size == len('new content')
+
+    with HashCache(tmp_path / 'cache.sqlite3') as cache:
+        hashed = local_digests(tmp_path, ['compared'], Checksum.Md5, cache)
+        assert list(hashed) == ['compared']
+        assert hashed['compared'].md5 == file_digests(tmp_path / 'compared').md5
+        assert cache.get(tmp_path / 'new', os.stat(tmp_path / 'new'), ['md5']) is None
@@ -0,0 +1,56 @@
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+from yandex_disk_rsync.data import FileBriefData, Checksum, same_content
+from yandex_disk_rsync.hashing import file_digests, benchmark
+
+
+@pytest.fixture
+def data_file(tmp_path: Path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 123))
+    return path
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+@pytest.mark.parametrize('buffer_size', [1000, 1024 * 1024])
+def test_file_digests(data_file, use_mmap, buffer_size):
+    content = data_file.read_bytes()
+    digests = file_digests(data_file, buffer_size=buffer_size, use_mmap=use_mmap)
+
+    assert digests.size == len(content)
+    assert digests.md5 == hashlib.md5(content).hexdigest()
+    assert digests.sha256 == hashlib.sha256(content).hexdigest()
+
+
+def test_file_digests_empty(tmp_path: Path):
+    path = tmp_path / 'empty'
+    path.touch()
+    digests = file_digests(path, ('md5',), use_mmap=True)
+
+    assert digests.size == 0
+    assert digests.md5 == hashlib.md5(b'').hexdigest()
+    assert digests.sha256 is None
+
+
+def test_benchmark(data_file):
+    results = benchmark(data_file, [64 * 1024], ['md5'], repeat=1)
+    assert [result.strategy for result in results] == ['readinto', 'mmap']
+
+
+def test_same_content_fallback():
+    local = FileBriefData(path='a', md5='1', size=10, sha256='s1')
+    remote = FileBriefData(path='a', md5='1', size=10, sha256='s2')
+    without_sha256 = FileBriefData(path='a', md5='1', size=10)
+
+    assert same_content(local, remote, Checksum.Md5)
+    assert not same_content(local, remote, Checksum.Sha256)
+    assert same_content(local, without_sha256, Checksum.Sha256)
+    assert same_content(
+        FileBriefData(path='a', md5=None, size=10),
+        remote,
+        Checksum.Size,
+    )
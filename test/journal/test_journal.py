@@ -0,0 +1,168 @@
+import types
+from pathlib import Path
+
+import pytest
+
+from yandex_disk_rsync import ArgsTarget, \
+    JobReport, \
+    SyncData, \
+    SyncJob, \
+    SyncType, \
+    apply_sync, \
+    journal_operations, \
+    resume_job, \
+    sync_lists_from_journal, \
+    verify_in_flight
+from yandex_disk_rsync import data
+from yandex_disk_rsync.config import SyncConfig
+from yandex_disk_rsync.journal import Journal
+
+
+def test_journal_round_trip(tmp_path: Path):
+    journal = Journal(tmp_path / 'journal.jsonl')
+    assert journal.load() is None
+
+    journal.start([{'path': 'a'}, {'path': 'b'}, {'path': 'c'}], meta={'target': 'both'})
+    journal.begin(0, 1)
+    journal.done(0)
+    journal.close()
+
+    plan = Journal(tmp_path / 'journal.jsonl').load()
+    assert plan.meta == {'target': 'both'}
+    assert plan.done == {0}
+    assert plan.in_flight == {1}
+    assert plan.remaining == 2
+
+    journal.complete()
+    assert not journal.file_path.exists()
+
+
+def test_journal_torn_record(tmp_path: Path):
+    journal = Journal(tmp_path / 'journal.jsonl')
+    journal.start([{'path': 'a'}, {'path': 'b'}], meta={})
+    journal.done(0)
+    journal.close()
+    with open(journal.file_path, 'a') as file:
+        file.write('{"kind": "done", "ids": [')
+
+    journal = Journal(journal.file_path)
+    assert journal.load().done == {0}
+
+    journal.resume()
+    journal.done(1)
+    journal.close()
+    assert Journal(journal.file_path).load().done == {0, 1}
+
+
+def test_journal_operations_round_trip():
+    local_sync_list = [SyncData(SyncType.Add, 'x/a', md5='1')]
+    remote_sync_list = [
+        SyncData(SyncType.Change, 'y/z/b', md5='2'),
+        SyncData(SyncType.Add, 'y/c', md5='3'),
+        SyncData(SyncType.Delete, 'd', is_dir=True),
+    ]
+    operations = journal_operations(local_sync_list, remote_sync_list, '/root')
+
+    assert [operation['type'] for operation in operations] == \
+        ['Add', 'Mkdir', 'Mkdir', 'Change', 'Add', 'Delete']
+    assert [operation['path'] for operation in operations if operation['type'] == 'Mkdir'] == \
+        ['/root/y', '/root/y/z']
+
+    restored_local, restored_remote = sync_lists_from_journal(operations)
+    assert restored_local == local_sync_list
+    assert [data.md5 for data in restored_remote] == ['2', '3', None]
+    assert restored_remote == remote_sync_list
+
+
+def test_apply_sync_skips_done_operations(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda: 'y')
+    root = tmp_path / 'root'
+    root.mkdir()
+    for name in ('a', 'b'):
+        (root / name).write_text(name)
+
+    local_sync_list = [
+        SyncData(SyncType.Delete, 'a'),
+        SyncData(SyncType.Delete, 'b'),
+    ]
+    journal = Journal(tmp_path / 'journal.jsonl')
+    journal.start(journal_operations(local_sync_list, [], '/root'), meta={})
+    journal.done(0)
+    journal.close()
+
+    journal = Journal(journal.file_path)
+    journal.load()
+    journal.resume()
+    apply_sync(None, local_sync_list, [], root, '/root', journal=journal)
+    journal.close()
+
+    # 'a' is done according to the journal
+    assert (root / 'a').exists()
+    assert not (root / 'b').exists()
+    assert Journal(journal.file_path).load().done == {0, 1}
+
+
+def test_journal_begin_is_synced(tmp_path: Path):
+    journal = Journal(tmp_path / 'journal.jsonl', batch_size=100, flush_interval=100)
+    journal.start([{'path': 'a'}, {'path': 'b'}], meta={})
+    journal.done(0)
+    journal.begin(1)
+
+    # Read by the next run after the crash, without close()
+    plan = Journal(journal.file_path).load()
+    assert plan.done == {0}
+    assert plan.in_flight == {1}
+
+    journal.discard()
+    assert not journal.file_path.exists()
+    assert Journal(journal.file_path).load() is None
+
+
+def test_apply_sync_repeats_local_delete(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda: 'y')
+    root = tmp_path / 'root'
+    root.mkdir()
+
+    # Deleted by the interrupted run before its done record
+    apply_sync(None, [SyncData(SyncType.Delete, 'a')], [], root, '/root')
+
+
+def test_resume_job_refuses_other_target(tmp_path: Path):
+    journal = Journal(tmp_path / 'journal.jsonl')
+    journal.start([{'side': 'local', 'type': 'Delete', 'path': 'a'}], meta={'target': 'local'})
+    journal.close()
+    plan = journal.load()
+
+    job = SyncJob(
+        name='job',
+        local_path=tmp_path,
+        yd_path=Path('/root'),
+        target=ArgsTarget.Disk,
+        delete=True,
+        sync=SyncConfig(local_path=str(tmp_path), yd_path='/root', delete=True),
+    )
+    with pytest.raises(RuntimeError, match='--discard-journal'):
+        resume_job(None, job, JobReport('job'), None, journal, plan, tmp_path / 'state.json')
+    assert journal.file_path.exists()
+
+
+def test_verify_in_flight_keeps_delete_on_api_errors(tmp_path: Path, monkeypatch):
+    ydcmd = pytest.importorskip('yandex_disk_rsync.ydcmd')
+    operations = journal_operations([], [SyncData(SyncType.Delete, 'a')], '/root')
+    journal = Journal(tmp_path / 'journal.jsonl')
+    journal.start(operations, meta={})
+    journal.begin(0)
+    journal.close()
+    plan = journal.load()
+    journal.resume()
+
+    def unavailable(options, method, url, args):
+        raise ydcmd.ydError(503, 'Service Unavailable')
+
+    monkeypatch.setattr(data, 'api_query', unavailable)
+    options = types.SimpleNamespace(ydcmd=types.SimpleNamespace(baseurl='https://api'))
+    with pytest.raises(ydcmd.ydError):
+        verify_in_flight(options, plan, journal, tmp_path, '/root')
+    journal.close()
+
+    assert Journal(journal.file_path).load().in_flight == {0}
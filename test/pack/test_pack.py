@@ -0,0 +1,152 @@
+import dataclasses
+from pathlib import Path
+
+import pytest
+
+from yandex_disk_rsync import pack
+from yandex_disk_rsync.data import FileBriefData
+from yandex_disk_rsync.pack import PackPlan, \
+    apply_pack, \
+    plan_bundles, \
+    split_packed, \
+    write_bundle, \
+    extract_bundle
+from yandex_disk_rsync.utils import file_md5
+
+BUNDLE_SIZE = 64 * 1024
+
+
+def _files(count):
+    return {
+        f'dir_{i // 100}/file_{i}': FileBriefData(
+            path=f'dir_{i // 100}/file_{i}',
+            md5=f'md5_{i}',
+            size=1000,
+        )
+        for i in range(count)
+    }
+
+
+def _digests(bundles):
+    return {bundle.name: bundle.digest for bundle in bundles}
+
+
+def test_plan_bundles_size_bound():
+    files = _files(1000)
+    bundles = plan_bundles(files, BUNDLE_SIZE)
+
+    assert len(bundles) > 1
+    assert all(bundle.size <= BUNDLE_SIZE for bundle in bundles)
+    assert sum(len(bundle.files) for bundle in bundles) == len(files)
+
+
+def test_plan_bundles_changed_file_affects_one_bundle():
+    files = _files(1000)
+    before = _digests(plan_bundles(files, BUNDLE_SIZE))
+
+    key = 'dir_5/file_500'
+    files[key] = dataclasses.replace(files[key], md5='changed')
+    after = _digests(plan_bundles(files, BUNDLE_SIZE))
+
+    assert before.keys() == after.keys()
+    assert sum(before[name] != after[name] for name in before) == 1
+
+
+def test_plan_bundles_new_file_keeps_most_bundles():
+    files = _files(1000)
+    before = _digests(plan_bundles(files, BUNDLE_SIZE))
+
+    files['dir_5/file_500_new'] = FileBriefData(
+        path='dir_5/file_500_new',
+        md5='new',
+        size=1000,
+    )
+    after = _digests(plan_bundles(files, BUNDLE_SIZE))
+
+    unchanged = set(before.items()).intersection(after.items())
+    assert len(unchanged) >= len(before) - 2
+
+
+def test_bundle_digest_without_md5():
+    files = {
+        'a': FileBriefData(path='a', md5=None, size=10, mtime=1.0),
+        'b': FileBriefData(path='b', md5=None, size=10, mtime=1.0),
+    }
+    bundle, = plan_bundles(files, BUNDLE_SIZE)
+    digest = bundle.digest
+
+    # same-size edit
+    files['a'] = dataclasses.replace(files['a'], mtime=2.0)
+    assert plan_bundles(files, BUNDLE_SIZE)[0].digest != digest
+
+    files['a'] = dataclasses.replace(files['a'], size=11, mtime=1.0)
+    assert plan_bundles(files, BUNDLE_SIZE)[0].digest != digest
+
+    # with md5 the touched file is the same
+    hashed = {path: dataclasses.replace(item, md5=path) for path, item in files.items()}
+    touched = {path: dataclasses.replace(item, mtime=3.0) for path, item in hashed.items()}
+    assert plan_bundles(hashed, BUNDLE_SIZE)[0].digest == plan_bundles(touched, BUNDLE_SIZE)[0].digest
+
+
+def test_split_packed():
+    stats = {
+        'build/a': FileBriefData(path='build/a', md5='1', size=10),
+        'build/big': FileBriefData(path='build/big', md5='2', size=1000),
+        'other/b': FileBriefData(path='other/b', md5='3', size=10),
+    }
+    packed, rest = split_packed(stats, 'build', 100)
+
+    assert packed == {'a': FileBriefData(path='a', md5='1', size=10)}
+    assert set(rest) == {'build/big', 'other/b'}
+
+
+def test_bundle_roundtrip(tmp_path: Path):
+    source = tmp_path / 'source'
+    (source / 'inner').mkdir(parents=True)
+    (source / 'a.txt').write_text('a')
+    (source / 'inner' / 'b.txt').write_text('b')
+
+    files = {
+        path: FileBriefData(path=path, md5=file_md5(source / path), size=1)
+        for path in ['a.txt', 'inner/b.txt']
+    }
+    bundle, = plan_bundles(files, BUNDLE_SIZE)
+    bundle_path = tmp_path / bundle.name
+    write_bundle(bundle, source, bundle_path)
+
+    target = tmp_path / 'target'
+    extract_bundle(bundle_path, target, ['inner/b.txt'])
+
+    assert not (target / 'a.txt').exists()
+    assert (target / 'inner' / 'b.txt').read_text() == 'b'
+
+
+def test_apply_pack_asks_before_local_deletes(tmp_path: Path, monkeypatch):
+    (tmp_path / 'build').mkdir()
+    (tmp_path / 'build' / 'stale').write_text('stale')
+    plan = PackPlan(subtree='build', upload=False, manifest={}, transfer=[], delete=['stale'])
+
+    monkeypatch.setattr('builtins.input', lambda: 'n')
+    with pytest.raises(RuntimeError):
+        apply_pack(None, plan, tmp_path, '/root')
+    assert (tmp_path / 'build' / 'stale').exists()
+
+    monkeypatch.setattr('builtins.input', lambda: 'y')
+    apply_pack(None, plan, tmp_path, '/root')
+    assert not (tmp_path / 'build' / 'stale').exists()
+
+
+def test_manifest_errors_are_not_missing_manifest(monkeypatch):
+    ydcmd = pytest.importorskip('yandex_disk_rsync.ydcmd')
+    status = {}
+
+    def download_file(options, remote_path, local_path, **kwargs):
+        raise ydcmd.ydError(status['errno'], 'error')
+
+    monkeypatch.setattr(pack, 'download_file', download_file)
+
+    status['errno'] = 404
+    assert pack._download_manifest(None, '/root/build/.ydsync-pack') == {}
+    status['errno'] = 503
+    with pytest.raises(ydcmd.ydError):
+        pack._download_manifest(None, '/root/build/.ydsync-pack')
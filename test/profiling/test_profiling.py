@@ -0,0 +1,55 @@
+import json
+import pstats
+import time
+from pathlib import Path
+
+from yandex_disk_rsync import profiling
+from yandex_disk_rsync.profiling import Profiler, ProfilerMode, counted, stage
+
+
+@counted
+def _hot(value):
+    return value * 2
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_counters_are_off_by_default():
+    profiling.counters.clear()
+    with stage('idle'):
+        assert _hot(2) == 4
+
+    assert not profiling.counters
+    assert not profiling.stage_timers
+
+
+def test_profiler_writes_reports(tmp_path: Path):
+    prefix = tmp_path / 'profile' / 'run'
+    with Profiler(prefix, ProfilerMode.Both):
+        with stage('transfer'):
+            for value in range(3):
+                _hot(value)
+            _busy(0.05)
+
+    counter = profiling.counters[f'{__name__}._hot']
+    assert counter.calls == 3
+    assert profiling.stage_timers['transfer'].calls == 1
+
+    summary = json.loads(prefix.with_name('run.json').read_text())
+    assert summary['stages']['transfer']['seconds'] >= 0.05
+    assert summary['counters'][f'{__name__}._hot']['calls'] == 3
+
+    stats = pstats.Stats(str(prefix.with_name('run.pstats')))
+    assert any(name == '_busy' for _, _, name in stats.stats)
+
+    lines = prefix.with_name('run.collapsed').read_text().splitlines()
+    assert any(line.startswith('stage:transfer;') and '_busy' in line for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+    # Profiling is off again
+    _hot(1)
+    assert profiling.counters[f'{__name__}._hot'].calls == 3
@@ -0,0 +1,81 @@
+import gzip
+from pathlib import Path
+
+from yandex_disk_rsync import SyncData, SyncType, collapse_deleted_subtrees
+from yandex_disk_rsync.report import ChangeSummary, \
+    default_changes_path, \
+    prune_change_lists, \
+    write_change_list
+from yandex_disk_rsync.shard import ShardSpec
+
+
+def _changes():
+    return [
+        SyncData(SyncType.Add, 'photos/2021/a.jpg', size=300),
+        SyncData(SyncType.Add, 'photos/2022/b.jpg', size=500),
+        SyncData(SyncType.Change, 'docs/c.txt', size=10),
+        SyncData(SyncType.Delete, 'old', is_dir=True, size=40),
+        SyncData(SyncType.Add, 'root.txt', size=1),
+    ]
+
+
+def test_change_summary():
+    summary = ChangeSummary.collect(_changes(), depth=1, top=2)
+
+    assert summary.count == 5
+    assert (summary.by_type['+'].count, summary.by_type['+'].size) == (3, 801)
+    assert summary.by_directory[('photos', '+')].size == 800
+    assert summary.by_directory[('.', '+')].count == 1
+    assert summary.by_directory[('old', '-')].size == 40
+
+    assert summary.largest() == [(500, 'photos/2022/b.jpg', '+'), (300, 'photos/2021/a.jpg', '+')]
+    assert [key for key, _ in summary.top_directories()] == [('photos', '+'), ('old', '-')]
+
+    deeper = ChangeSummary.collect(_changes(), depth=2)
+    assert ('photos/2021', '+') in deeper.by_directory
+
+
+def test_collapsed_deletion_size():
+    data = [
+        SyncData(SyncType.Delete, 'gone/a', size=1),
+        SyncData(SyncType.Delete, 'gone/b', size=2),
+    ]
+    collapsed, = collapse_deleted_subtrees(data, ['gone/a', 'gone/b', 'kept'])
+    assert collapsed.relative_path == 'gone'
+    assert collapsed.size == 3
+
+
+def test_write_change_list(tmp_path: Path):
+    file_path = tmp_path / 'changes.tsv.gz'
+    written = write_change_list(
+        file_path,
+        (('local', _changes()[:1]), ('remote', _changes()[3:4])),
+        conflicts=['both.txt'],
+    )
+
+    assert written == 3
+    with gzip.open(file_path, 'rt', encoding='UTF-8') as file:
+        assert file.read().splitlines() == [
+            'side\ttype\tsize\tpath',
+            'local\tAdd\t300\tphotos/2021/a.jpg',
+            'remote\tDelete\t40\told/',
+            'both\tConflict\t\tboth.txt',
+        ]
+
+
+def test_prune_change_lists(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    changes_dir = default_changes_path(tmp_path, '/disk').parent
+    changes_dir.mkdir(parents=True)
+    prefix = default_changes_path(tmp_path, '/disk').name.split('-')[0]
+    names = [f'{prefix}-20240101-0000{i:02}.tsv.gz' for i in range(5)]
+    for name in names:
+        (changes_dir / name).write_bytes(b'')
+    shard_path = default_changes_path(tmp_path, '/disk', ShardSpec(0, 2))
+    shard_path.write_bytes(b'')
+    other_path = default_changes_path(tmp_path / 'other', '/disk')
+    other_path.write_bytes(b'')
+
+    assert prune_change_lists(tmp_path, '/disk', keep=2) == 3
+    assert sorted(path.name for path in changes_dir.iterdir()) == \
+        sorted([*names[3:], shard_path.name, other_path.name])
@@ -0,0 +1,114 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+
+import yandex_disk_rsync
+from yandex_disk_rsync import Args
+from yandex_disk_rsync.shard import ShardSpec, \
+    ShardBy, \
+    ShardStatus, \
+    shard_filter, \
+    shared_size_assignment, \
+    size_balanced_assignment, \
+    write_shard_report, \
+    merge_shard_reports
+from yandex_disk_rsync.state import pending_state_path, shard_state_path, shard_state_paths
+
+
+def test_shard_spec_parse():
+    assert ShardSpec.parse('1/4') == ShardSpec(index=1, count=4)
+    with pytest.raises(RuntimeError):
+        ShardSpec.parse('4/4')
+    with pytest.raises(RuntimeError):
+        ShardSpec.parse('abc')
+
+
+def test_hash_shards_partition():
+    names = [f'dir_{i}' for i in range(100)]
+    filters = [
+        shard_filter(ShardSpec(index=i, count=3))
+        for i in range(3)
+    ]
+
+    for name in names:
+        assert sum(predicate(name) for predicate in filters) == 1
+
+
+def test_size_balanced_assignment():
+    sizes = {'a': 100, 'b': 60, 'c': 50, 'd': 10}
+    assignment = size_balanced_assignment(sizes, 2)
+
+    assert assignment == {'a': 0, 'b': 1, 'c': 1, 'd': 0}
+    assert assignment == size_balanced_assignment(dict(reversed(sizes.items())), 2)
+
+
+def test_size_shard_filter(tmp_path: Path):
+    local_path = tmp_path / 'local'
+    (local_path / 'big').mkdir(parents=True)
+    (local_path / 'big' / 'file').write_bytes(b'0' * 1000)
+    (local_path / 'small').write_bytes(b'0' * 10)
+    shard_dir = tmp_path / 'shards'
+
+    first_spec = ShardSpec(index=0, count=2, by=ShardBy.Size)
+    first = shard_filter(
+        first_spec,
+        shared_size_assignment(shard_dir, 'run', first_spec, local_path, '/disk'),
+    )
+    # Grows before the second worker starts, the published assignment is kept
+    (local_path / 'small').write_bytes(b'0' * 10000)
+    second_spec = ShardSpec(index=1, count=2, by=ShardBy.Size)
+    second = shard_filter(
+        second_spec,
+        shared_size_assignment(shard_dir, 'run', second_spec, local_path, '/disk'),
+    )
+
+    assert first('big') and not second('big')
+    assert second('small') and not first('small')
+    assert [path.name for path in (shard_dir / 'run').iterdir()] == \
+        [f'assignment-{hashlib.md5(b"/disk").hexdigest()}.json']
+
+    with pytest.raises(RuntimeError):
+        shared_size_assignment(shard_dir, 'run', ShardSpec(0, 3, ShardBy.Size), local_path, '/disk')
+
+
+def test_run_id_is_required_with_shard_dir():
+    parser = getattr(yandex_disk_rsync, '__arg_parser')()
+    with pytest.raises(RuntimeError, match='--run-id'):
+        Args(parser.parse_args(['--shard', '0/2', '--shard-dir', 'shards']))
+    with pytest.raises(RuntimeError, match='--shard-dir'):
+        Args(parser.parse_args(['--shard', '0/2', '--shard-by', 'size']))
+
+    args = Args(parser.parse_args(['--shard', '0/2', '--shard-dir', 'shards', '--run-id', 'run']))
+    assert args.run_id == 'run'
+
+
+def test_merge_shard_reports(tmp_path: Path):
+    jobs = [{'name': 'sync', 'exit_code': 0, 'changes': {'remote add': 2}}]
+    write_shard_report(tmp_path, 'run', ShardSpec(0, 3), ShardStatus.Finished, jobs)
+    write_shard_report(tmp_path, 'run', ShardSpec(1, 3), ShardStatus.Running)
+
+    merged = merge_shard_reports(tmp_path, 'run')
+    assert not merged.complete
+    assert merged.finished == [0]
+    assert set(merged.unfinished) == {1, 2}
+    assert merged.unfinished[2] == 'missing'
+    assert merged.changes == {'remote add': 2}
+    assert (tmp_path / 'run' / 'merged.json').exists()
+
+    write_shard_report(tmp_path, 'run', ShardSpec(1, 3), ShardStatus.Finished, jobs)
+    write_shard_report(tmp_path, 'run', ShardSpec(2, 3), ShardStatus.Finished)
+    assert merge_shard_reports(tmp_path, 'run').complete
+
+
+def test_shard_state_paths(tmp_path: Path):
+    state_path = tmp_path / 'state.json'
+    paths = [shard_state_path(state_path, ShardSpec(index=i, count=2)) for i in range(2)]
+
+    assert paths[0].name == 'state-shard-0-of-2.json'
+    assert len({*paths, *map(pending_state_path, paths)}) == 4
+
+    for file_path in paths:
+        file_path.write_text('{}')
+    pending_state_path(paths[0]).write_text('{}')
+    assert set(shard_state_paths(state_path)) == set(paths)
@@ -0,0 +1,97 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+# Cumulative import time of the package itself, microseconds
+IMPORT_TIME_BUDGET_US = 200_000
+
+HEAVY_MODULES = [
+    'yandex_disk_rsync.ydcmd',
+    'requests',
+    'yaml',
+    'dateutil',
+    'ssl',
+    'http.client',
+]
+
+# Loaded only by the features, which use them
+STDLIB_HEAVY_MODULES = [
+    'sqlite3',
+    'tarfile',
+    'gzip',
+    'socket',
+    'concurrent.futures',
+    'cProfile',
+]
+
+
+def _run_python(code, *options):
+    return subprocess.run(
+        [sys.executable, *options, '-c', code],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def _loaded_heavy_modules(code):
+    result = _run_python(
+        f'''import sys, json
+{code}
+print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))'''
+    )
+    return json.loads(result.stdout.strip().split('\n')[-1])
+
+
+def test_import_does_not_load_heavy_modules():
+    assert _loaded_heavy_modules('import yandex_disk_rsync') == []
+
+
+@pytest.mark.parametrize('argv', [['-h'], ['--target', 'wrong']])
+def test_cli_help_does_not_load_heavy_modules(argv):
+    code = f'''from yandex_disk_rsync import cli_main
+sys.argv = ['ydsync', *{argv!r}]
+try:
+    cli_main()
+except SystemExit:
+    pass'''
+    assert _loaded_heavy_modules(code) == []
+
+
+def test_config_loading_does_not_load_network_modules():
+    config_path = PROJECT_ROOT / 'test' / 'config' / 'test_config_3_jobs.yaml'
+    loaded = _loaded_heavy_modules(f'''from yandex_disk_rsync.config import Config, deserialize_yaml
+from yandex_disk_rsync.utils import file_text_read
+import yaml
+options = deserialize_yaml({str(config_path)!r})
+Config.get_unused_keys(yaml.safe_load(file_text_read({str(config_path)!r})))
+assert [job.name for job in options.jobs] == ['photos', 'docs']''')
+    # yaml is the only dependency of the configuration
+    assert loaded == ['yaml']
+
+
+def test_import_does_not_load_stdlib_heavy_modules():
+    code = '''import yandex_disk_rsync'''
+    result = _run_python(f'''import sys, json
+{code}
+print(json.dumps([m for m in {STDLIB_HEAVY_MODULES!r} if m in sys.modules]))''')
+    assert json.loads(result.stdout.strip().split('\n')[-1]) == []
+
+
+def test_import_time_budget():
+    result = _run_python('import yandex_disk_rsync', '-X', 'importtime')
+
+    cumulative = None
+    for line in result.stderr.split('\n'):
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == 'yandex_disk_rsync':
+            cumulative = int(parts[1])
+
+    assert cumulative is not None
+    assert cumulative < IMPORT_TIME_BUDGET_US
@@ -0,0 +1,143 @@
+from yandex_disk_rsync import SyncData, \
+    SyncType, \
+    ConflictPolicy, \
+    collapse_deleted_subtrees, \
+    compare_three_way, \
+    state_after_sync
+from yandex_disk_rsync.data import FileBriefData
+
+
+def _delete(path, is_dir=False):
+    return SyncData(type=SyncType.Delete, relative_path=path, is_dir=is_dir)
+
+
+def test_collapse_deleted_subtrees():
+    target_paths = [
+        'a/1',
+        'a/b/2',
+        'a/b/3',
+        'c/4',
+        'c/5',
+        '6',
+    ]
+    data = [
+        _delete('a/1'),
+        _delete('a/b/2'),
+        _delete('a/b/3'),
+        _delete('c/4'),
+        _delete('6'),
+    ]
+
+    assert collapse_deleted_subtrees(data, target_paths) == [
+        _delete('a', is_dir=True),
+        _delete('c/4'),
+        _delete('6'),
+    ]
+
+
+def test_collapse_deleted_subtrees_keeps_partially_deleted():
+    target_paths = ['a/b/1', 'a/b/2', 'a/3']
+    data = [
+        SyncData(type=SyncType.Add, relative_path='a/4'),
+        _delete('a/b/1'),
+        _delete('a/b/2'),
+    ]
+
+    assert collapse_deleted_subtrees(data, target_paths) == [
+        SyncData(type=SyncType.Add, relative_path='a/4'),
+        _delete('a/b', is_dir=True),
+    ]
+
+
+def test_collapse_deleted_subtrees_keeps_directories_with_uploads():
+    target_paths = ['a/b/1', 'a/b/2']
+    data = [
+        SyncData(type=SyncType.Add, relative_path='a/b/4'),
+        _delete('a/b/1'),
+        _delete('a/b/2'),
+    ]
+
+    assert collapse_deleted_subtrees(data, target_paths) == data
+
+
+def test_collapse_deleted_subtrees_keeps_pack_dirs():
+    # The pack directory is excluded from the listing, the bundles stay
+    target_paths = ['build/big.bin', 'other/1']
+    data = [_delete('build/big.bin'), _delete('other/1')]
+
+    assert collapse_deleted_subtrees(data, target_paths, kept_dirs=['build/.ydsync-pack']) == [
+        _delete('build/big.bin'),
+        _delete('other', is_dir=True),
+    ]
+
+
+def _files(**md5s):
+    return {
+        path: FileBriefData(path=path, md5=md5, mtime=float(len(md5)))
+        for path, md5 in md5s.items()
+    }
+
+
+def test_compare_three_way():
+    base = _files(same='1', changed_l='1', changed_r='1', deleted_l='1',
+                  deleted_r='1', both='1')
+    local = _files(same='1', changed_l='2', changed_r='1', deleted_r='1',
+                   added_l='1', both='22', converged='5')
+    remote = _files(same='1', changed_l='1', changed_r='2', deleted_l='1',
+                    added_r='1', both='333', converged='5')
+
+    not_in_local, not_in_remote, conflicts = compare_three_way(
+        local, remote, base, can_delete=True,
+    )
+
+    assert not_in_local == [
+        SyncData(type=SyncType.Add, relative_path='added_r'),
+        SyncData(type=SyncType.Change, relative_path='changed_r'),
+        SyncData(type=SyncType.Delete, relative_path='deleted_r'),
+    ]
+    assert not_in_remote == [
+        SyncData(type=SyncType.Add, relative_path='added_l'),
+        SyncData(type=SyncType.Change, relative_path='changed_l'),
+        SyncData(type=SyncType.Delete, relative_path='deleted_l'),
+    ]
+    assert conflicts == ['both']
+
+    _, not_in_remote, conflicts = compare_three_way(
+        local, remote, base, policy=ConflictPolicy.Local,
+    )
+    assert SyncData(type=SyncType.Change, relative_path='both') in not_in_remote
+    assert conflicts == []
+
+    not_in_local, _, _ = compare_three_way(
+        local, remote, base, policy=ConflictPolicy.Newer,
+    )
+    assert SyncData(type=SyncType.Change, relative_path='both') in not_in_local
+
+
+def test_compare_three_way_restores_without_delete():
+    base = _files(a='1', b='1')
+    not_in_local, not_in_remote, _ = compare_three_way(
+        _files(b='1'), _files(a='1'), base,
+    )
+
+    assert not_in_local == [SyncData(type=SyncType.Add, relative_path='a')]
+    assert not_in_remote == [SyncData(type=SyncType.Add, relative_path='b')]
+
+
+def test_state_after_sync():
+    base = _files(a='1', c='1')
+    local = _files(a='2', b='1', c='3')
+    remote = _files(a='1', c='4', d='1')
+    not_in_local, not_in_remote, conflicts = compare_three_way(
+        local, remote, base, can_delete=True,
+    )
+
+    state = state_after_sync(
+        local, remote, base, not_in_local, not_in_remote, conflicts,
+    )
+    assert {k: v.md5 for k, v in state.files.items()} == {
+        'a': '2',
+        'b': '1',
+        'c': '1',
+        'd': '1',
+    }
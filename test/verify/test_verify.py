@@ -0,0 +1,195 @@
+import os
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+from yandex_disk_rsync import data, verify
+from yandex_disk_rsync.config import SyncConfig
+from yandex_disk_rsync.data import Checksum, FileBriefData, YdFileBriefData, yd_file_brief
+from yandex_disk_rsync.hash_cache import HashCache
+from yandex_disk_rsync.hashing import Digests, file_digests
+from yandex_disk_rsync.state import SyncState, pending_state_path
+from yandex_disk_rsync.verify import FindingKind, \
+    RepairAction, \
+    VerifyMode, \
+    VerifyReport, \
+    select_sample, \
+    verify_candidates, \
+    verify_file, \
+    verify_job
+
+
+def test_rotating_sample_wraps_around():
+    candidates = ['a', 'b', 'c', 'd', 'e']
+
+    assert select_sample(candidates, VerifyMode.Rotating, 2) == ['a', 'b']
+    assert select_sample(candidates, VerifyMode.Rotating, 2, cursor='b') == ['c', 'd']
+    assert select_sample(candidates, VerifyMode.Rotating, 3, cursor='d') == ['e', 'a', 'b']
+    # The cursor file may be removed since the last run
+    assert select_sample(candidates, VerifyMode.Rotating, 1, cursor='bb') == ['c']
+
+    sample = select_sample(candidates, VerifyMode.Random, 3)
+    assert len(set(sample)) == 3 and set(sample) <= set(candidates)
+
+
+def test_verify_candidates(tmp_path: Path):
+    (tmp_path / 'packed').mkdir()
+    (tmp_path / 'packed' / 'small').write_text('')
+    (tmp_path / 'dir').mkdir()
+    (tmp_path / 'dir' / 'file').write_text('')
+    (tmp_path / 'top').write_text('')
+    (tmp_path / '.top.ydsync-part').write_text('')
+    index = {'deleted': FileBriefData('deleted', md5='0')}
+
+    assert verify_candidates(tmp_path, index, ['packed']) == ['deleted', 'dir/file', 'top']
+
+
+def _verify(monkeypatch, tmp_path: Path, remote_md5, synced_at, index_md5=None, hash_cache=None):
+    file_path = tmp_path / 'file'
+    monkeypatch.setattr(
+        verify,
+        'yd_file_brief',
+        lambda options, path: YdFileBriefData(path, md5=remote_md5, mtime=synced_at - 10),
+    )
+    report = VerifyReport('job', tmp_path, '/disk', VerifyMode.Rotating)
+    index_item = FileBriefData('file', md5=index_md5 or file_digests(file_path).md5)
+    verify_file(
+        None,
+        'file',
+        tmp_path,
+        '/disk',
+        index_item,
+        synced_at,
+        Checksum.Md5,
+        report,
+        hash_cache=hash_cache,
+    )
+    return report
+
+
+def test_verify_file_matches(monkeypatch, tmp_path: Path):
+    (tmp_path / 'file').write_text('content')
+    md5 = file_digests(tmp_path / 'file').md5
+
+    report = _verify(monkeypatch, tmp_path, md5, time.time() + 60)
+    assert report.findings == []
+    assert report.bytes_read == len('content')
+
+
+def test_verify_file_detects_remote_mismatch(monkeypatch, tmp_path: Path):
+    (tmp_path / 'file').write_text('content')
+
+    finding, = _verify(monkeypatch, tmp_path, 'other', time.time() + 60).findings
+    assert finding.kind == FindingKind.RemoteMismatch
+    assert finding.repair == RepairAction.Upload
+
+
+def test_verify_file_detects_local_corruption(monkeypatch, tmp_path: Path):
+    file_path = tmp_path / 'file'
+    file_path.write_text('content')
+    md5 = file_digests(file_path).md5
+    stat = os.stat(file_path)
+
+    with HashCache(tmp_path / 'cache.sqlite3') as cache:
+        cache.put(file_path, stat, file_digests(file_path))
+        # same size and mtime, different bytes
+        file_path.write_text('CONTENT')
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        report = _verify(monkeypatch, tmp_path, md5, time.time() + 60, index_md5=md5, hash_cache=cache)
+
+    finding, = report.findings
+    assert finding.kind == FindingKind.LocalCorrupted
+    assert finding.repair == RepairAction.Download
+
+
+def test_verify_file_skips_pending_changes(monkeypatch, tmp_path: Path):
+    (tmp_path / 'file').write_text('changed after the sync')
+
+    report = _verify(monkeypatch, tmp_path, 'old', time.time() - 60, index_md5='old')
+    assert report.findings == []
+    assert report.pending == 1
+
+
+def test_verify_job_uses_completion_time(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    local_path = tmp_path / 'local'
+    local_path.mkdir()
+    file_path = local_path / 'file'
+    file_path.write_text('content')
+    state_path = tmp_path / 'state.json'
+
+    # The pending state is written before the transfers
+    SyncState({'file': FileBriefData('file', md5='old')}).save(pending_state_path(state_path))
+    SyncState.commit(state_path)
+    assert not pending_state_path(state_path).exists()
+    # The state file time is not the completion time
+    os.utime(state_path, (0, 0))
+
+    synced_at = []
+    monkeypatch.setattr(
+        verify,
+        'verify_file',
+        lambda *args, **kwargs: synced_at.append(args[5]),
+    )
+    sync = SyncConfig(local_path=str(local_path), yd_path='/disk', delete=False, state_path=state_path)
+    verify_job(None, 'job', local_path, '/disk', sync)
+
+    assert synced_at == [SyncState.load(state_path).synced_at]
+    assert synced_at[0] > time.time() - 60
+
+
+def test_commit_fills_digests_of_uploads(tmp_path: Path):
+    state_path = tmp_path / 'state.json'
+    SyncState({
+        'new': FileBriefData('new', md5=None, size=7, mtime=1.0),
+        'old': FileBriefData('old', md5='1', size=1, mtime=1.0),
+    }).save(pending_state_path(state_path))
+
+    SyncState.commit(state_path, {'new': Digests(size=7, md5='2'), 'gone': Digests(size=0, md5='3')})
+
+    files = SyncState.load(state_path).files
+    assert files['new'] == FileBriefData('new', md5='2', size=7, mtime=1.0)
+    assert files['old'].md5 == '1'
+    assert 'gone' not in files
+
+
+def test_only_missing_remote_file_is_none(monkeypatch):
+    ydcmd = pytest.importorskip('yandex_disk_rsync.ydcmd')
+    status = {}
+
+    def api_query(options, method, url, args):
+        raise ydcmd.ydError(status['errno'], 'error')
+
+    monkeypatch.setattr(data, 'api_query', api_query)
+    options = types.SimpleNamespace(baseurl='https://api')
+
+    status['errno'] = 404
+    assert yd_file_brief(options, '/disk/file') is None
+    status['errno'] = 401
+    with pytest.raises(ydcmd.ydError):
+        yd_file_brief(options, '/disk/file')
+
+
+def test_verify_job_stops_on_api_errors(monkeypatch, tmp_path: Path):
+    ydcmd = pytest.importorskip('yandex_disk_rsync.ydcmd')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    local_path = tmp_path / 'local'
+    local_path.mkdir()
+    for name in ('a', 'b'):
+        (local_path / name).write_text(name)
+
+    def unavailable(options, path):
+        raise ydcmd.ydError(401, 'Unauthorized')
+
+    monkeypatch.setattr(verify, 'yd_file_brief', unavailable)
+    sync = SyncConfig(local_path=str(local_path), yd_path='/disk', delete=False,
+                      state_path=tmp_path / 'state.json')
+    sync.verify_cycle_days = 1
+    report = verify_job(None, 'job', local_path, '/disk', sync)
+
+    assert report.findings == []
+    assert report.checked == 0
+    assert report.error.startswith('a: ')
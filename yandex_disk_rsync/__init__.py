@@ -1,38 +1,125 @@
 import argparse
+import collections
 import dataclasses
 import enum
+import itertools
 import os
 from pathlib import Path
-from typing import List, Callable, Dict, Optional
+from typing import List, Dict, Optional, Iterable, Tuple
 
-from yandex_disk_rsync.config import get_available_config_path, deserialize_yaml
+from yandex_disk_rsync.config import get_available_config_path, \
+    deserialize_yaml, \
+    SyncConfig
 from yandex_disk_rsync.data import YdInfo, \
     yd_listdir, \
     local_listdir, \
+    local_digests, \
     FileBriefData, \
-    yd_mkdir_recursive
+    Checksum, \
+    same_content, \
+    yd_mkdir_recursive, \
+    yd_delete_batch, \
+    yd_exists, \
+    yd_file_md5, \
+    YdListCache
+from yandex_disk_rsync.hash_cache import HashCache
+from yandex_disk_rsync.hashing import Digests
+from yandex_disk_rsync.journal import Journal, JournalPlan, default_journal_path
 from yandex_disk_rsync.log import logger
-from yandex_disk_rsync.utils import runtime_path, ask_to_continue, mkdir_p_from_file
-from yandex_disk_rsync import ydcmd
+from yandex_disk_rsync.pack import PACK_DIR_NAME, \
+    PackPlan, \
+    split_packed, \
+    exclude_pack_dir, \
+    plan_pack_upload, \
+    plan_pack_download, \
+    apply_pack
+from yandex_disk_rsync.profiling import Profiler, ProfilerMode, stage
+from yandex_disk_rsync.report import ChangeSummary, \
+    default_changes_path, \
+    prune_change_lists, \
+    write_change_list
+from yandex_disk_rsync.shard import ShardSpec, \
+    ShardBy, \
+    ShardStatus, \
+    shard_filter, \
+    shared_size_assignment, \
+    top_level_name, \
+    write_shard_report, \
+    merge_shard_reports
+from yandex_disk_rsync.state import SyncState, \
+    default_state_path, \
+    pending_state_path, \
+    shard_state_path
+from yandex_disk_rsync.transfer import download_file, set_http_pool_size, upload_file
+from yandex_disk_rsync.utils import runtime_path, \
+    ask_to_continue, \
+    lazy_import, \
+    mkdir_p_from_file, \
+    file_md5, \
+    ydcmd
+from yandex_disk_rsync.verify import VerifyMode, \
+    VerifyReport, \
+    default_verify_report_path, \
+    verify_job, \
+    write_repair_plan, \
+    write_verify_report
+
+futures = lazy_import('concurrent.futures')
+
+
+class ArgsCommand(enum.Enum):
+    Sync = 'sync'
+    MergeShards = 'merge-shards'
+    Verify = 'verify'
 
 
 class ArgsTarget(enum.Enum):
     Disk = 'disk'
     Local = 'local'
+    Both = 'both'
 
 
 @dataclasses.dataclass
 class Args:
+    command: ArgsCommand
     config: Optional[Path]
-    target: ArgsTarget
+    target: Optional[ArgsTarget]
     delete: bool
     local_path: Optional[Path] = None
     yd_path: Optional[Path] = None
+    jobs: List[str] = dataclasses.field(default_factory=list)
+    shard: Optional[ShardSpec] = None
+    shard_dir: Optional[Path] = None
+    run_id: Optional[str] = None
+    profile: Optional[Path] = None
+    profiler: ProfilerMode = ProfilerMode.Both
+    repair_plan: Optional[Path] = None
+    discard_journal: bool = False
 
     def __init__(self, args):
+        self.command = ArgsCommand(args.command)
         self.config = runtime_path() / args.config if args.config else None
-        self.target = ArgsTarget(args.target)
+        self.target = ArgsTarget(args.target) if args.target else None
         self.delete = args.delete
+        self.jobs = args.jobs or []
+        self.run_id = args.run_id
+        self.profiler = ProfilerMode(args.profiler)
+        self.discard_journal = args.discard_journal
+
+        if args.shard:
+            self.shard = ShardSpec.parse(args.shard, ShardBy(args.shard_by))
+        if args.shard_dir:
+            self.shard_dir = runtime_path() / args.shard_dir
+            # Reports of different runs must not be merged together
+            if not self.run_id:
+                raise RuntimeError("--run-id is required with --shard-dir")
+        if self.shard and self.shard.by == ShardBy.Size and not self.shard_dir:
+            raise RuntimeError("--shard-by size requires --shard-dir "
+                               "to share the assignment between workers")
+        if args.profile:
+            self.profile = runtime_path() / args.profile
+        if args.repair_plan:
+            self.repair_plan = runtime_path() / args.repair_plan
 
         if args.local_path:
             self.local_path = runtime_path() / args.local_path
@@ -43,12 +130,24 @@ class Args:
         return f'''Config path : {str(self.config)}
         Local path  : {str(self.local_path)}
         Disk path   : {self.yd_path}
-        Target      : {self.target.value}
-        Can delete  : {self.delete}'''
+        Target      : {self.target.value if self.target else None}
+        Can delete  : {self.delete}
+        Jobs        : {', '.join(self.jobs) or 'all'}
+        Shard       : {self.shard}
+        Profile     : {self.profile}'''
 
 
 def __arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'command',
+        help='Synchronize (default), merge the shard reports '
+             'or verify a sample of the synchronized files',
+        type=str,
+        nargs='?',
+        default='sync',
+        choices=['sync', 'merge-shards', 'verify'],
+    )
     parser.add_argument(
         '--config',
         '-c',
@@ -75,10 +174,13 @@ def __arg_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         '--target',
         '-t',
-        help='Target, the synchronization destination (editable)',
+        help='Target, the synchronization destination (editable). '
+             'Both means the two-way synchronization. '
+             'Overrides targets of the configured jobs',
         type=str,
-        required=True,
-        choices=['disk', 'local'],
+        required=False,
+        default=None,
+        choices=['disk', 'local', 'both'],
         dest='target',
     )
     parser.add_argument(
@@ -89,6 +191,83 @@ def __arg_parser() -> argparse.ArgumentParser:
         required=False,
         dest='delete',
     )
+    parser.add_argument(
+        '--job',
+        '-j',
+        help='Run only the configured job with this name (repeatable)',
+        type=str,
+        action='append',
+        required=False,
+        dest='jobs',
+    )
+    parser.add_argument(
+        '--shard',
+        help='Synchronize only the shard I of N, e.g. 0/4',
+        type=str,
+        required=False,
+        default=None,
+        dest='shard',
+    )
+    parser.add_argument(
+        '--shard-by',
+        help='Partition top level directories by path hash or by size',
+        type=str,
+        required=False,
+        default='hash',
+        choices=['hash', 'size'],
+        dest='shard_by',
+    )
+    parser.add_argument(
+        '--shard-dir',
+        help='Shared directory for the shard reports',
+        type=str,
+        required=False,
+        default=None,
+        dest='shard_dir',
+    )
+    parser.add_argument(
+        '--run-id',
+        help='Identifier of the sharded run, e.g. the date, '
+             'required with --shard-dir',
+        type=str,
+        required=False,
+        default=None,
+        dest='run_id',
+    )
+    parser.add_argument(
+        '--profile',
+        help='Profile the run into PROFILE.pstats, PROFILE.collapsed '
+             '(flamegraph stacks) and PROFILE.json (stages and counters)',
+        type=str,
+        required=False,
+        default=None,
+        dest='profile',
+    )
+    parser.add_argument(
+        '--profiler',
+        help='cProfile, the sampling profiler or both',
+        type=str,
+        required=False,
+        default='both',
+        choices=['cprofile', 'sample', 'both'],
+        dest='profiler',
+    )
+    parser.add_argument(
+        '--repair-plan',
+        help='Verify: write the actions fixing the findings into this file',
+        type=str,
+        required=False,
+        default=None,
+        dest='repair_plan',
+    )
+    parser.add_argument(
+        '--discard-journal',
+        help='Drop the plan of the interrupted run instead of resuming it',
+        action='store_true',
+        default=False,
+        required=False,
+        dest='discard_journal',
+    )
     return parser
 
 
@@ -109,11 +288,11 @@ class SyncType(enum.Enum):
 class SyncData:
     type: SyncType
     relative_path: str
-
-
-def print_sync_data_list(data: List[SyncData], printer: Callable) -> None:
-    for item in data:
-        printer(f'[ {item.type.as_one_char()} ] {item.relative_path}')
+    is_dir: bool = False
+    # Expected md5 of the transferred file
+    md5: Optional[str] = dataclasses.field(default=None, compare=False)
+    # Transferred or removed bytes, for the reports
+    size: Optional[int] = dataclasses.field(default=None, compare=False)
 
 
 def compare_before_sync(
@@ -122,6 +301,7 @@ def compare_before_sync(
         can_add: bool = False,
         can_change: bool = False,
         can_delete: bool = False,
+        checksum: Checksum = Checksum.Md5,
 ) -> List[SyncData]:
     result: List[SyncData] = []
 
@@ -131,15 +311,20 @@ def compare_before_sync(
                 SyncData(
                     type=SyncType.Add,
                     relative_path=item.path,
+                    md5=item.md5,
+                    size=item.size,
                 )
             ]
             continue
 
-        if can_change and data_target[key].md5 != data_original[key].md5:
+        if can_change \
+                and not same_content(data_target[key], data_original[key], checksum):
             result += [
                 SyncData(
                     type=SyncType.Change,
                     relative_path=item.path,
+                    md5=item.md5,
+                    size=item.size,
                 )
             ]
             continue
@@ -153,34 +338,408 @@ def compare_before_sync(
                 SyncData(
                     type=SyncType.Delete,
                     relative_path=item.path,
+                    size=item.size,
                 )
             ]
 
     return result
 
 
+class ConflictPolicy(enum.Enum):
+    Skip = 'skip'
+    Local = 'local'
+    Remote = 'remote'
+    Newer = 'newer'
+
+
+def _is_changed(
+        item: Optional[FileBriefData],
+        base_item: Optional[FileBriefData],
+        checksum: Checksum,
+) -> bool:
+    if item is None or base_item is None:
+        return (item is None) != (base_item is None)
+    return not same_content(item, base_item, checksum)
+
+
+def _sync_type(
+        source: Optional[FileBriefData],
+        target: Optional[FileBriefData],
+        checksum: Checksum,
+) -> Optional[SyncType]:
+    if source is None:
+        return SyncType.Delete if target is not None else None
+    if target is None:
+        return SyncType.Add
+    if not same_content(source, target, checksum):
+        return SyncType.Change
+    return None
+
+
+def _resolve_conflict(
+        local_item: Optional[FileBriefData],
+        remote_item: Optional[FileBriefData],
+        policy: ConflictPolicy,
+) -> Optional[ArgsTarget]:
+    """
+    :return: The winner side or None, if the conflict is skipped
+    """
+    if policy == ConflictPolicy.Local:
+        return ArgsTarget.Local
+    if policy == ConflictPolicy.Remote:
+        return ArgsTarget.Disk
+    if policy == ConflictPolicy.Newer:
+        local_mtime = (local_item.mtime or 0) if local_item else 0
+        remote_mtime = (remote_item.mtime or 0) if remote_item else 0
+        if local_mtime > remote_mtime:
+            return ArgsTarget.Local
+        if remote_mtime > local_mtime:
+            return ArgsTarget.Disk
+    return None
+
+
+def compare_three_way(
+        data_local: Dict[str, FileBriefData],
+        data_remote: Dict[str, FileBriefData],
+        data_base: Dict[str, FileBriefData],
+        policy: ConflictPolicy = ConflictPolicy.Skip,
+        can_delete: bool = False,
+        checksum: Checksum = Checksum.Md5,
+) -> Tuple[List[SyncData], List[SyncData], List[str]]:
+    """
+    Compare both sides against the last synchronized state
+
+    :return: Changes for local, changes for remote and conflicted paths
+    """
+    not_in_local: List[SyncData] = []
+    not_in_remote: List[SyncData] = []
+    conflicts: List[str] = []
+
+    for key in sorted(data_local.keys() | data_remote.keys()):
+        local_item = data_local.get(key)
+        remote_item = data_remote.get(key)
+        base_item = data_base.get(key)
+
+        local_changed = _is_changed(local_item, base_item, checksum)
+        remote_changed = _is_changed(remote_item, base_item, checksum)
+        if not local_changed and not remote_changed:
+            continue
+
+        if local_changed and remote_changed:
+            if _sync_type(local_item, remote_item, checksum) is None:
+                continue
+
+            source = _resolve_conflict(local_item, remote_item, policy)
+            if source is None:
+                conflicts.append(key)
+                continue
+        else:
+            source = ArgsTarget.Local if local_changed else ArgsTarget.Disk
+
+        if source == ArgsTarget.Local:
+            sync_type = _sync_type(local_item, remote_item, checksum)
+        else:
+            sync_type = _sync_type(remote_item, local_item, checksum)
+
+        # Deletion is not allowed: restore the file from the other side
+        if sync_type == SyncType.Delete and not can_delete:
+            source = ArgsTarget.Disk \
+                if source == ArgsTarget.Local \
+                else ArgsTarget.Local
+            sync_type = SyncType.Add
+
+        source_item = local_item if source == ArgsTarget.Local else remote_item
+        target_item = remote_item if source == ArgsTarget.Local else local_item
+        sync_data = SyncData(
+            type=sync_type,
+            relative_path=key,
+            md5=source_item.md5 if source_item else None,
+            size=source_item.size if source_item else target_item.size,
+        )
+        if source == ArgsTarget.Local:
+            not_in_remote.append(sync_data)
+        else:
+            not_in_local.append(sync_data)
+
+    return not_in_local, not_in_remote, conflicts
+
+
+def state_after_sync(
+        data_local: Dict[str, FileBriefData],
+        data_remote: Dict[str, FileBriefData],
+        data_base: Dict[str, FileBriefData],
+        local_sync_list: List[SyncData],
+        remote_sync_list: List[SyncData],
+        conflicts: List[str],
+        checksum: Checksum = Checksum.Md5,
+) -> SyncState:
+    """
+    The state both sides will share after the successful synchronization
+    """
+    files: Dict[str, FileBriefData] = {
+        key: item
+        for key, item in data_local.items()
+        if key in data_remote and same_content(data_remote[key], item, checksum)
+    }
+
+    for sync_list, source in (
+            (local_sync_list, data_remote),
+            (remote_sync_list, data_local),
+    ):
+        for data in sync_list:
+            if data.type == SyncType.Delete:
+                files.pop(data.relative_path, None)
+            else:
+                files[data.relative_path] = source[data.relative_path]
+
+    for key in conflicts:
+        if key in data_base:
+            files[key] = data_base[key]
+
+    return SyncState(files=files)
+
+
+def _parent_dirs(relative_path: str) -> List[str]:
+    """
+    Parent directories from the top one, the root is excluded
+    """
+    parts = relative_path.split('/')[:-1]
+    return ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def collapse_deleted_subtrees(
+        data: List[SyncData],
+        target_paths: Iterable[str],
+        kept_dirs: Iterable[str] = (),
+) -> List[SyncData]:
+    """
+    Replace file deletions with a single directory deletion,
+    if the whole directory disappears
+
+    :param kept_dirs: Directories, which are never deleted as a whole
+        with their parents, e.g. the pack directories excluded from the listing
+    """
+    deleted = {
+        item.relative_path
+        for item in data
+        if item.type == SyncType.Delete
+    }
+    if not deleted:
+        return data
+
+    # Directories, which keep files or receive new ones in the same plan
+    remaining: Dict[str, int] = {}
+    kept_paths = itertools.chain(
+        (path for path in target_paths if path not in deleted),
+        (item.relative_path for item in data if item.type != SyncType.Delete),
+        (f'{directory}/' for directory in kept_dirs),
+    )
+    for path in kept_paths:
+        for parent in _parent_dirs(path):
+            remaining[parent] = remaining.get(parent, 0) + 1
+
+    result: List[SyncData] = []
+    collapsed: Dict[str, SyncData] = {}
+    for item in data:
+        if item.type != SyncType.Delete:
+            result.append(item)
+            continue
+
+        top_deleted = next(
+            (d for d in _parent_dirs(item.relative_path) if d not in remaining),
+            None,
+        )
+        if top_deleted is None:
+            result.append(item)
+            continue
+
+        if top_deleted not in collapsed:
+            collapsed[top_deleted] = SyncData(
+                type=SyncType.Delete,
+                relative_path=top_deleted,
+                is_dir=True,
+                size=0,
+            )
+            result.append(collapsed[top_deleted])
+        collapsed[top_deleted].size += item.size or 0
+
+    return result
+
+
+def remote_mkdir_list(
+        remote_sync_list: List[SyncData],
+        remote_root_path: str,
+) -> List[str]:
+    """
+    Unique disk directories for the uploads, parents go first
+    """
+    dirs = set()
+    for data in remote_sync_list:
+        if data.type not in {SyncType.Add, SyncType.Change}:
+            continue
+
+        parent = Path(f'{remote_root_path}/{data.relative_path}').parent
+        if parent.as_posix() != '.':
+            dirs.add(parent.as_posix())
+
+    return sorted(dirs)
+
+
+def journal_operations(
+        local_sync_list: List[SyncData],
+        remote_sync_list: List[SyncData],
+        remote_root_path: str,
+) -> List[dict]:
+    """
+    Operations in the apply_sync order, the index is the operation id
+    """
+    return [
+        *(
+            {
+                'side': 'local',
+                'type': data.type.name,
+                'path': data.relative_path,
+                'md5': data.md5,
+                'is_dir': data.is_dir,
+            }
+            for data in local_sync_list
+        ),
+        *(
+            {'side': 'remote', 'type': 'Mkdir', 'path': path}
+            for path in remote_mkdir_list(remote_sync_list, remote_root_path)
+        ),
+        *(
+            {
+                'side': 'remote',
+                'type': data.type.name,
+                'path': data.relative_path,
+                'md5': data.md5,
+                'is_dir': data.is_dir,
+            }
+            for data in remote_sync_list
+        ),
+    ]
+
+
+def sync_lists_from_journal(
+        operations: List[dict],
+) -> Tuple[List[SyncData], List[SyncData]]:
+    local_sync_list: List[SyncData] = []
+    remote_sync_list: List[SyncData] = []
+    for operation in operations:
+        if operation['type'] == 'Mkdir':
+            continue
+
+        data = SyncData(
+            type=SyncType[operation['type']],
+            relative_path=operation['path'],
+            is_dir=operation['is_dir'],
+            md5=operation['md5'],
+        )
+        if operation['side'] == 'local':
+            local_sync_list.append(data)
+        else:
+            remote_sync_list.append(data)
+
+    return local_sync_list, remote_sync_list
+
+
+def verify_in_flight(
+        options: config.Config,
+        plan: JournalPlan,
+        journal: Journal,
+        local_root_path: Path,
+        remote_root_path: str,
+) -> None:
+    """
+    Cheap checks of the operations, interrupted in the middle.
+    Completed ones are marked as done, the rest is repeated
+    """
+    local_root_path = local_root_path.resolve()
+    for operation_id in sorted(plan.in_flight):
+        operation = plan.operations[operation_id]
+        sync_type = operation['type']
+        if sync_type == 'Mkdir':
+            continue
+
+        if operation['side'] == 'local':
+            local_path = local_root_path / operation['path']
+            if sync_type == SyncType.Delete.name:
+                completed = not local_path.exists()
+            else:
+                completed = local_path.is_file() \
+                    and operation['md5'] is not None \
+                    and file_md5(local_path) == operation['md5']
+        else:
+            disk_url = f'{remote_root_path}/{operation["path"]}'
+            if sync_type == SyncType.Delete.name:
+                completed = not yd_exists(options.ydcmd, disk_url)
+            else:
+                completed = operation['md5'] is not None \
+                    and yd_file_md5(options.ydcmd, disk_url) == operation['md5']
+
+        logger.info(f"In-flight {operation['side']} {sync_type.lower()} "
+                    f"of {operation['path']}: "
+                    f"{'completed' if completed else 'will be repeated'}")
+        if completed:
+            journal.done(operation_id)
+
+
 def apply_sync(
         options: config.Config,
         local_sync_list: List[SyncData],
         remote_sync_list: List[SyncData],
         local_root_path: Path,
         remote_root_path: str,
-):
+        executor: Optional['futures.Executor'] = None,
+        hash_cache: Optional[HashCache] = None,
+        journal: Optional[Journal] = None,
+) -> Dict[str, Digests]:
+    """
+    Transfers hash the streamed bytes: downloads are verified against
+    the remote md5 and all transferred files are recorded into the hash cache.
+    Operation ids follow the journal_operations order,
+    operations done according to the journal are skipped
+
+    :return: Digests of the uploaded files, new files are hashed only here
+    """
+    uploaded: Dict[str, Digests] = {}
     local_root_path = local_root_path.resolve()
+    operation_ids = itertools.count()
+
+    def is_done(operation_id):
+        return journal is not None and journal.is_done(operation_id)
+
+    def begin(*ids):
+        if journal is not None:
+            journal.begin(*ids)
+
+    def done(*ids):
+        if journal is not None:
+            journal.done(*ids)
 
     # Download to the local storage
     for data in local_sync_list:
+        operation_id = next(operation_ids)
+        if is_done(operation_id):
+            continue
+
         if data.type in {SyncType.Add, SyncType.Change}:
             disk_url = f'{remote_root_path}/{data.relative_path}'
             local_path = local_root_path / data.relative_path
             local_path.parent.mkdir(parents=True, exist_ok=True)
 
             logger.info(f"Copy from {disk_url} to {local_path}")
-            ydcmd.yd_get(
+            begin(operation_id)
+            download_file(
                 options.ydcmd,
                 disk_url,
-                str(local_path),
+                local_path,
+                expected_md5=data.md5,
+                hash_cache=hash_cache,
+                algorithms=Checksum(options.sync.checksum).algorithms(),
             )
+            done(operation_id)
             continue
 
         if data.type == SyncType.Delete:
@@ -188,82 +747,201 @@ def apply_sync(
             logger.warning(f"Removing {local_path}")
 
             ask_to_continue()
-            local_path.unlink()
+            begin(operation_id)
+            # Repeated after the interrupted run
+            local_path.unlink(missing_ok=True)
+            if hash_cache is not None:
+                hash_cache.remove(local_path)
+            done(operation_id)
             continue
 
         logger.error(f"Unknown SyncData type: {data.type}")
 
+    # Create directories on the disk once
+    for path in remote_mkdir_list(remote_sync_list, remote_root_path):
+        operation_id = next(operation_ids)
+        if is_done(operation_id):
+            continue
+
+        begin(operation_id)
+        yd_mkdir_recursive(options.ydcmd, path)
+        done(operation_id)
+
     # Download into the disk
+    remote_delete_ids: Dict[str, int] = {}
     for data in remote_sync_list:
+        operation_id = next(operation_ids)
+        if is_done(operation_id):
+            continue
+
         if data.type in {SyncType.Add, SyncType.Change}:
             disk_url = f'{remote_root_path}/{data.relative_path}'
             local_path = local_root_path / data.relative_path
 
-            disk_url_path = Path(disk_url)
-            if len(disk_url_path.parents) - 1 > 0:
-                yd_mkdir_recursive(options.ydcmd, disk_url_path.parent)
-
             logger.info(f"Copy from {local_path} to disk:{disk_url}")
-            ydcmd.yd_put(
+            begin(operation_id)
+            uploaded[data.relative_path] = upload_file(
                 options.ydcmd,
-                str(local_path),
-                disk_url
+                local_path,
+                disk_url,
+                expected_md5=data.md5,
+                hash_cache=hash_cache,
+                algorithms=Checksum(options.sync.checksum).algorithms(),
             )
+            done(operation_id)
             continue
 
         if data.type == SyncType.Delete:
             disk_url = f'{remote_root_path}/{data.relative_path}'
             logger.warning(f"Removing disk:{disk_url}")
-
-            ask_to_continue()
-            ydcmd.yd_delete(options.ydcmd, disk_url)
+            remote_delete_ids[disk_url] = operation_id
             continue
 
         logger.error(f"Unknown SyncData type: {data.type}")
 
+    if remote_delete_ids:
+        logger.warning(
+            f"{len(remote_delete_ids)} items will be removed from disk"
+            + (" permanently" if options.sync.delete_permanently else "")
+        )
+        ask_to_continue()
+        begin(*remote_delete_ids.values())
+        failed = yd_delete_batch(
+            options.ydcmd,
+            list(remote_delete_ids),
+            permanently=options.sync.delete_permanently,
+            threads=options.sync.threads,
+            executor=executor,
+        )
+        done(*(
+            operation_id
+            for disk_url, operation_id in remote_delete_ids.items()
+            if disk_url not in failed
+        ))
+        if failed:
+            raise RuntimeError(f"Unable to delete {len(failed)} disk items")
 
-def cli_main():
-    parser = __arg_parser()
-    args = Args(parser.parse_args())
-    return main(args)
+    return uploaded
 
 
-def main(args: Args):
-    logger.info("Arguments:")
-    logger.info(args)
+@dataclasses.dataclass
+class SyncJob:
+    name: str
+    local_path: Path
+    yd_path: Path
+    # Not required for the verification
+    target: Optional[ArgsTarget]
+    delete: bool
+    sync: SyncConfig
 
-    options = deserialize_yaml(get_available_config_path(args.config))
-    if not options.ydcmd.token:
-        logger.error(f'No token provided')
 
-    info = YdInfo.deserialize(ydcmd.yd_info(options.ydcmd))
-    logger.info("YaDisk info:")
-    logger.info(info)
+@dataclasses.dataclass
+class JobReport:
+    name: str
+    exit_code: int = 0
+    changes: Dict[str, int] = dataclasses.field(
+        default_factory=lambda: collections.defaultdict(int)
+    )
+    error: Optional[str] = None
 
-    if args.local_path:
-        local_path = args.local_path
-    elif options.sync.local_path:
-        local_path = options.sync.local_path
-    else:
-        local_path = None
-        logger.error(
-            'Unspecified local_path. '
-            'Use arguments or the configuration'
-        )
+    def serialize(self):
+        """
+        :rtype: dict
+        """
+        return {
+            'name': self.name,
+            'exit_code': self.exit_code,
+            'changes': dict(self.changes),
+            'error': self.error,
+        }
+
+    def __str__(self):
+        status = 'OK' if self.exit_code == 0 else f'FAILED ({self.error})'
+        changes = ', '.join(
+            f'{key}: {value}'
+            for key, value in self.changes.items()
+            if value
+        ) or 'no changes'
+        return f'[{self.exit_code}] {self.name}: {status}; {changes}'
 
-    if args.yd_path:
-        yd_path = args.yd_path
-    elif options.sync.yd_path:
-        yd_path = options.sync.yd_path
+
+def _resolve_jobs(
+        args: Args,
+        options: config.Config,
+        require_target: bool = True,
+) -> List[SyncJob]:
+    if options.jobs and not args.local_path and not args.yd_path:
+        job_configs = [
+            job
+            for job in options.jobs
+            if not args.jobs or job.name in args.jobs
+        ]
+        unknown = set(args.jobs).difference(job.name for job in options.jobs)
+        if unknown:
+            raise RuntimeError(f"Unknown jobs: {', '.join(sorted(unknown))}")
     else:
-        yd_path = None
-        logger.error(
-            'Unspecified yd_path. '
-            'Use arguments or the configuration'
-        )
+        job_configs = [options.sync]
+
+    jobs: List[SyncJob] = []
+    for i, job_config in enumerate(job_configs):
+        local_path = args.local_path or job_config.local_path
+        yd_path = args.yd_path or job_config.yd_path
+        target = args.target \
+            or (ArgsTarget(job_config.target) if job_config.target else None)
+        name = job_config.name or (f'job {i}' if len(job_configs) > 1 else 'sync')
+
+        if not local_path:
+            logger.error(
+                f'Unspecified local_path for "{name}". '
+                'Use arguments or the configuration'
+            )
+        if not yd_path:
+            logger.error(
+                f'Unspecified yd_path for "{name}". '
+                'Use arguments or the configuration'
+            )
+        if not target and require_target:
+            logger.error(
+                f'Unspecified target for "{name}". '
+                'Use arguments or the configuration'
+            )
+        if not local_path or not yd_path or (not target and require_target):
+            raise RuntimeError("Misconfigured")
+
+        jobs.append(SyncJob(
+            name=name,
+            local_path=local_path,
+            yd_path=yd_path,
+            target=target,
+            delete=args.delete or job_config.delete,
+            sync=job_config,
+        ))
 
-    if not local_path or not yd_path:
-        raise RuntimeError("Misconfigured")
+    return jobs
+
+
+@dataclasses.dataclass
+class SyncContext:
+    """
+    Resources, shared by the jobs of one process
+    """
+    list_cache: YdListCache
+    executor: 'futures.Executor'
+    hash_cache: Optional[HashCache] = None
+    shard: Optional[ShardSpec] = None
+    shard_dir: Optional[Path] = None
+    run_id: Optional[str] = None
+    discard_journal: bool = False
+
+
+def run_job(
+        options: config.Config,
+        job: SyncJob,
+        report: JobReport,
+        context: SyncContext,
+) -> None:
+    local_path = job.local_path
+    job_options = dataclasses.replace(options, sync=job.sync)
 
     if not local_path.exists():
         os.mkdir(local_path)
@@ -271,53 +949,466 @@ def main(args: Args):
     if not local_path.is_dir():
         raise RuntimeError(f"{local_path} is not a directory")
 
-    # collect local hashsums
-    local_stats = {
-        entry.path: entry
-        for entry in local_listdir(options.ydcmd, local_path)
-    }
-    logger.info(f"Collected {len(local_stats)} local files")
+    disk_root_path = job.yd_path.as_posix()
+    in_shard = None
+    if context.shard:
+        assignment = shared_size_assignment(
+            context.shard_dir,
+            context.run_id,
+            context.shard,
+            local_path,
+            disk_root_path,
+        ) if context.shard.by == ShardBy.Size else None
+        in_shard = shard_filter(context.shard, assignment)
+    checksum = Checksum(job.sync.checksum)
+    hash_cache = context.hash_cache if job.sync.hash_cache else None
+    tree_state_path = job.sync.state_path \
+        or default_state_path(local_path, disk_root_path)
+    state_path = shard_state_path(tree_state_path, context.shard) \
+        if context.shard \
+        else tree_state_path
+
+    journal = None
+    if job.sync.journal:
+        journal = Journal(default_journal_path(
+            local_path,
+            disk_root_path,
+            context.shard,
+        ))
+        if context.discard_journal and journal.file_path.exists():
+            logger.warning(f'Discarding the interrupted sync "{journal.file_path}"')
+            journal.discard()
+            pending_state_path(state_path).unlink(missing_ok=True)
+        plan = journal.load()
+        if plan is not None:
+            resume_job(
+                job_options,
+                job,
+                report,
+                context,
+                journal,
+                plan,
+                state_path,
+            )
+            return
+
+    # collect local files, they are hashed after the remote listing
+    with stage('traversal'):
+        local_stats = {
+            entry.path: entry
+            for entry in local_listdir(
+                options.ydcmd,
+                local_path,
+                path_filter=in_shard,
+                checksum=Checksum.Size,
+            )
+        }
+        logger.info(f"Collected {len(local_stats)} local files")
 
     # collect remote hashsums
-    disk_root_path = yd_path.as_posix()
-    remote_stats = {
-        entry.path: entry
-        for entry in yd_listdir(options.ydcmd, disk_root_path)
-    }
-    logger.info(f"Collected {len(remote_stats)} remote files")
-
-    # compare
-    can_change_local = args.target == ArgsTarget.Local
-    can_change_disk = args.target == ArgsTarget.Disk
-    not_in_local = compare_before_sync(
-        remote_stats,
-        local_stats,
-        can_add=can_change_local,
-        can_change=can_change_local,
-        can_delete=can_change_local and args.delete
-    )
-    not_in_remote = compare_before_sync(
-        local_stats,
-        remote_stats,
-        can_add=can_change_disk,
-        can_change=can_change_disk,
-        can_delete=can_change_disk and args.delete
-    )
+    with stage('listing'):
+        remote_stats = {
+            entry.path: entry
+            for entry in yd_listdir(
+                options.ydcmd,
+                disk_root_path,
+                cache=context.list_cache,
+                path_filter=in_shard,
+            )
+        }
+        logger.info(f"Collected {len(remote_stats)} remote files")
+
+    if in_shard and not state_path.exists() and tree_state_path.exists():
+        # the first sharded run continues the state of the whole tree
+        base_state = SyncState.load(tree_state_path)
+        base_state.files = {
+            key: item
+            for key, item in base_state.files.items()
+            if in_shard(top_level_name(key))
+        }
+    else:
+        base_state = SyncState.load(state_path)
+
+    # Only files compared by the content are hashed,
+    # new files are hashed while they are uploaded
+    with stage('hashing'):
+        pack_prefixes = tuple(f'{subtree}/' for subtree in job.sync.pack)
+        compared = [
+            key
+            for key in local_stats
+            if key in remote_stats
+            or key.startswith(pack_prefixes)
+            or (job.target == ArgsTarget.Both and key in base_state.files)
+        ]
+        local_stats.update(local_digests(local_path, compared, checksum, hash_cache))
+        logger.info(f"Hashed {len(compared)} of {len(local_stats)} local files")
+
+    # small files of the packed subtrees are synchronized as bundles
+    pack_plans: List[PackPlan] = []
+    pack_dirs: List[str] = []
+    for subtree in job.sync.pack:
+        if in_shard and not in_shard(top_level_name(subtree)):
+            continue
+
+        remote_stats = exclude_pack_dir(remote_stats, subtree)
+        pack_dirs.append(f'{subtree}/{PACK_DIR_NAME}')
+        if job.target == ArgsTarget.Both:
+            logger.warning(f"Packing is not supported for the two-way sync, "
+                           f"'{subtree}' is synchronized file by file")
+            continue
+
+        packed_stats, local_stats = split_packed(
+            local_stats,
+            subtree,
+            job.sync.pack_max_file_size,
+        )
+        if job.target == ArgsTarget.Disk:
+            pack_plans.append(plan_pack_upload(
+                options.ydcmd,
+                subtree,
+                packed_stats,
+                disk_root_path,
+                job.sync.pack_bundle_size,
+            ))
+        else:
+            pack_plans.append(plan_pack_download(
+                options.ydcmd,
+                subtree,
+                packed_stats,
+                disk_root_path,
+                can_delete=job.delete,
+            ))
+
+    with stage('diff'):
+        # compare
+        conflicts: List[str] = []
+        if job.target == ArgsTarget.Both:
+            not_in_local, not_in_remote, conflicts = compare_three_way(
+                local_stats,
+                remote_stats,
+                base_state.files,
+                policy=ConflictPolicy(job.sync.conflict_policy),
+                can_delete=job.delete,
+                checksum=checksum,
+            )
+        else:
+            can_change_local = job.target == ArgsTarget.Local
+            can_change_disk = job.target == ArgsTarget.Disk
+            not_in_local = compare_before_sync(
+                remote_stats,
+                local_stats,
+                can_add=can_change_local,
+                can_change=can_change_local,
+                can_delete=can_change_local and job.delete,
+                checksum=checksum,
+            )
+            not_in_remote = compare_before_sync(
+                local_stats,
+                remote_stats,
+                can_add=can_change_disk,
+                can_change=can_change_disk,
+                can_delete=can_change_disk and job.delete,
+                checksum=checksum,
+            )
+
+        new_state = state_after_sync(
+            local_stats,
+            remote_stats,
+            base_state.files,
+            not_in_local,
+            not_in_remote,
+            conflicts,
+            checksum=checksum,
+        )
+        not_in_remote = collapse_deleted_subtrees(
+            not_in_remote,
+            remote_stats.keys(),
+            kept_dirs=pack_dirs,
+        )
+
+    for title, sync_list in (
+            ("=========   Not in local    =========", not_in_local),
+            ("=========   Not in remote   =========", not_in_remote),
+    ):
+        logger.info(title)
+        ChangeSummary.collect(
+            sync_list,
+            depth=job.sync.report_depth,
+            top=job.sync.report_top,
+        ).print(logger.info)
 
-    logger.info("=========   Not in local    =========")
-    print_sync_data_list(not_in_local, logger.info)
+    if not_in_local or not_in_remote or conflicts:
+        changes_path = default_changes_path(local_path, disk_root_path, context.shard)
+        written = write_change_list(
+            changes_path,
+            (('local', not_in_local), ('remote', not_in_remote)),
+            conflicts,
+        )
+        logger.info(f'Full list of {written} changes: "{changes_path}"')
+        prune_change_lists(local_path, disk_root_path, context.shard)
 
-    logger.info("=========   Not in remote   =========")
-    print_sync_data_list(not_in_remote, logger.info)
+    if pack_plans:
+        logger.info("=========      Bundles      =========")
+        for plan in pack_plans:
+            logger.info(plan)
+
+    if conflicts:
+        logger.warning("=========     Conflicts     =========")
+        for key in conflicts[:job.sync.report_top]:
+            logger.warning(f'[ ! ] {key}')
+        if len(conflicts) > job.sync.report_top:
+            logger.warning(f'... and {len(conflicts) - job.sync.report_top} more')
 
     logger.info("-------------------------------------")
     ask_to_continue()
 
     # Sync
-    apply_sync(
+    with stage('transfer'):
+        new_state.save(pending_state_path(state_path))
+        if journal is not None:
+            journal.start(
+                journal_operations(not_in_local, not_in_remote, disk_root_path),
+                meta={
+                    'local_path': str(local_path.resolve()),
+                    'yd_path': disk_root_path,
+                    'target': job.target.value,
+                },
+            )
+
+        try:
+            uploaded = apply_sync(
+                job_options,
+                not_in_local,
+                not_in_remote,
+                local_path,
+                disk_root_path,
+                executor=context.executor,
+                hash_cache=hash_cache,
+                journal=journal,
+            )
+            for plan in pack_plans:
+                apply_pack(
+                    options.ydcmd,
+                    plan,
+                    local_path,
+                    disk_root_path,
+                    threads=job.sync.threads,
+                    executor=context.executor,
+                )
+        finally:
+            if journal is not None:
+                journal.close()
+            if not_in_remote or pack_plans:
+                context.list_cache.invalidate(f'disk:/{disk_root_path}')
+
+    SyncState.commit(state_path, uploaded)
+    if journal is not None:
+        journal.complete()
+
+    for sync_list, key in (
+            (not_in_local, 'local'),
+            (not_in_remote, 'remote'),
+    ):
+        for data in sync_list:
+            report.changes[f'{key} {data.type.name.lower()}'] += 1
+    report.changes['bundles'] = sum(len(plan.transfer) for plan in pack_plans)
+    report.changes['conflicts'] = len(conflicts)
+
+
+def resume_job(
+        options: config.Config,
+        job: SyncJob,
+        report: JobReport,
+        context: SyncContext,
+        journal: Journal,
+        plan: JournalPlan,
+        state_path: Path,
+) -> None:
+    """
+    Continue the interrupted run without listing and hashing the trees
+    """
+    disk_root_path = job.yd_path.as_posix()
+    logger.warning(
+        f'Resuming the interrupted sync from "{journal.file_path}": '
+        f'{plan.remaining} of {len(plan.operations)} operations left, '
+        f'{len(plan.in_flight)} in flight'
+    )
+    if plan.meta.get('target') != job.target.value:
+        raise RuntimeError(
+            f"The interrupted sync target is {plan.meta.get('target')}, "
+            f"not {job.target.value}: finish it with the same target "
+            f"or drop it with --discard-journal"
+        )
+    ask_to_continue()
+
+    local_sync_list, remote_sync_list = sync_lists_from_journal(plan.operations)
+    hash_cache = context.hash_cache if job.sync.hash_cache else None
+
+    journal.resume()
+    try:
+        verify_in_flight(options, plan, journal, job.local_path, disk_root_path)
+        uploaded = apply_sync(
+            options,
+            local_sync_list,
+            remote_sync_list,
+            job.local_path,
+            disk_root_path,
+            executor=context.executor,
+            hash_cache=hash_cache,
+            journal=journal,
+        )
+    finally:
+        journal.close()
+        context.list_cache.invalidate(f'disk:/{disk_root_path}')
+
+    if pending_state_path(state_path).exists():
+        SyncState.commit(state_path, uploaded)
+    journal.complete()
+
+    report.changes['resumed'] = plan.remaining
+
+
+def verify_main(args: Args, options: config.Config, jobs: List[SyncJob]) -> int:
+    reports: List[VerifyReport] = []
+    hash_cache = HashCache() if any(job.sync.hash_cache for job in jobs) else None
+    try:
+        for job in jobs:
+            logger.info(f'=========   Verify "{job.name}"   =========')
+            try:
+                report = verify_job(
+                    options.ydcmd,
+                    job.name,
+                    job.local_path,
+                    job.yd_path.as_posix(),
+                    job.sync,
+                    hash_cache=hash_cache if job.sync.hash_cache else None,
+                )
+            except Exception as e:
+                logger.exception(f'Verification of "{job.name}" failed')
+                report = VerifyReport(
+                    name=job.name,
+                    local_path=job.local_path,
+                    yd_path=job.yd_path.as_posix(),
+                    mode=VerifyMode(job.sync.verify_mode),
+                    error=str(e) or type(e).__name__,
+                )
+            reports.append(report)
+    finally:
+        if hash_cache is not None:
+            hash_cache.close()
+
+    logger.info("=========      Reports      =========")
+    for report in reports:
+        if report.findings or report.error:
+            logger.error(report)
+        else:
+            logger.info(report)
+
+    report_path = default_verify_report_path()
+    write_verify_report(report_path, reports)
+    logger.info(f'Verification report: "{report_path}"')
+
+    if args.repair_plan:
+        planned = write_repair_plan(args.repair_plan, reports)
+        logger.info(f'Repair plan of {planned} actions: "{args.repair_plan}"')
+
+    return 1 if any(report.findings or report.error for report in reports) else 0
+
+
+def cli_main():
+    parser = __arg_parser()
+    args = Args(parser.parse_args())
+    return main(args)
+
+
+def main(args: Args) -> int:
+    logger.info("Arguments:")
+    logger.info(args)
+
+    if args.command == ArgsCommand.MergeShards:
+        if not args.shard_dir:
+            raise RuntimeError("--shard-dir is required to merge shards")
+        merged = merge_shard_reports(args.shard_dir, args.run_id)
+        return 0 if merged.complete else 1
+
+    if args.profile:
+        with Profiler(args.profile, args.profiler):
+            return sync_main(args)
+    return sync_main(args)
+
+
+def sync_main(args: Args) -> int:
+    options = deserialize_yaml(get_available_config_path(args.config))
+    if not options.ydcmd.token:
+        logger.error(f'No token provided')
+
+    jobs = _resolve_jobs(
+        args,
         options,
-        not_in_local,
-        not_in_remote,
-        local_path,
-        disk_root_path
+        require_target=args.command != ArgsCommand.Verify,
     )
+
+    info = YdInfo.deserialize(ydcmd.yd_info(options.ydcmd))
+    logger.info("YaDisk info:")
+    logger.info(info)
+
+    if args.command == ArgsCommand.Verify:
+        return verify_main(args, options, jobs)
+
+    if args.shard and args.shard_dir:
+        write_shard_report(
+            args.shard_dir,
+            args.run_id,
+            args.shard,
+            ShardStatus.Running,
+        )
+
+    # Jobs share the process: connections, listings, hashes and the thread pool.
+    # The pool fits the largest job, every job limits its own requests
+    threads = max(1, options.sync.threads, *(job.sync.threads for job in jobs))
+    set_http_pool_size(threads)
+    reports: List[JobReport] = []
+    hash_cache = HashCache() if any(job.sync.hash_cache for job in jobs) else None
+    try:
+        with futures.ThreadPoolExecutor(threads) as executor:
+            context = SyncContext(
+                list_cache=YdListCache(),
+                executor=executor,
+                hash_cache=hash_cache,
+                shard=args.shard,
+                shard_dir=args.shard_dir,
+                run_id=args.run_id,
+                discard_journal=args.discard_journal,
+            )
+            for job in jobs:
+                logger.info(f'=========   Job "{job.name}"   =========')
+                report = JobReport(name=job.name)
+                reports.append(report)
+                try:
+                    run_job(options, job, report, context)
+                except Exception as e:
+                    logger.exception(f'Job "{job.name}" failed')
+                    report.exit_code = 1
+                    report.error = str(e) or type(e).__name__
+    finally:
+        if hash_cache is not None:
+            hash_cache.close()
+
+    logger.info("=========      Reports      =========")
+    for report in reports:
+        if report.exit_code:
+            logger.error(report)
+        else:
+            logger.info(report)
+
+    exit_code = max(report.exit_code for report in reports)
+    if args.shard and args.shard_dir:
+        write_shard_report(
+            args.shard_dir,
+            args.run_id,
+            args.shard,
+            ShardStatus.Failed if exit_code else ShardStatus.Finished,
+            jobs=[report.serialize() for report in reports],
+        )
+
+    return exit_code
@@ -1,4 +1,6 @@
+import sys
+
 from yandex_disk_rsync import cli_main
 
 if __name__ == '__main__':
-    cli_main()
+    sys.exit(cli_main())
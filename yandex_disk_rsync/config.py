@@ -1,22 +1,81 @@
 import dataclasses
-from typing import Optional
+from typing import Optional, List
 
-import yaml
-import yandex_disk_rsync.ydcmd as ydcmd
 from yandex_disk_rsync.log import logger
-from yandex_disk_rsync.utils import open_text_read
+from yandex_disk_rsync.utils import open_text_read, lazy_import, ydcmd, is_enabled
 
 import collections
 
 from pathlib import Path
 
+yaml = lazy_import('yaml')
+
+
+# Keys of ydcmd.yd_default_config(): the configuration is checked
+# without importing ydcmd and its network stack
+YDCMD_CONFIG_KEYS = frozenset({
+    'timeout',
+    'poll',
+    'retries',
+    'delay',
+    'limit',
+    'chunk',
+    'token',
+    'quiet',
+    'verbose',
+    'debug',
+    'async',
+    'rsync',
+    'no-recursion',
+    'no-recursion-tag',
+    'exclude-tag',
+    'skip-download',
+    'skip-hash',
+    'threads',
+    'iconv',
+    'base-url',
+    'ca-file',
+    'ciphers',
+    'depth',
+    'dry',
+    'encrypt',
+    'decrypt',
+    'encrypt-cmd',
+    'decrypt-cmd',
+    'temp-dir',
+    'progress',
+})
+
+# Transfers are made through the shared HTTP session,
+# ydcmd transfers are used only for the encryption and apply these keys
+YDCMD_ENCRYPTION_KEYS = frozenset({'encrypt', 'decrypt'})
+YDCMD_TRANSFER_KEYS = frozenset({
+    'encrypt-cmd',
+    'decrypt-cmd',
+    'temp-dir',
+    'ciphers',
+    'chunk',
+})
+
+
+def _get_ydcmd_ignored_fields(content):
+    """
+    Transfer options, which have no effect without the encryption
+
+    :type content: dict
+    :rtype: list[str]
+    """
+    if any(is_enabled(content.get(key)) for key in YDCMD_ENCRYPTION_KEYS):
+        return []
+    return sorted(YDCMD_TRANSFER_KEYS.intersection(content))
+
 
 def _get_ydcmd_unused_fields(content):
     """
     :type content: dict
     :rtype: list[str]
     """
-    default_keys = set(ydcmd.yd_default_config().keys())
+    default_keys = YDCMD_CONFIG_KEYS
     content_keys = set(content.keys())
 
     wrong_keys = content_keys.difference(default_keys.intersection(content_keys))
@@ -42,8 +101,49 @@ class SyncConfig:
     local_path: Optional[Path]
     yd_path: Optional[Path]
     delete: bool
-
-    def __init__(self, local_path, yd_path, delete):
+    name: Optional[str]
+    target: Optional[str]
+    checksum: str
+    hash_cache: bool
+    journal: bool
+    report_top: int
+    report_depth: int
+    verify_mode: str
+    verify_cycle_days: int
+    verify_max_bytes: Optional[int]
+    verify_max_seconds: Optional[float]
+    delete_permanently: bool
+    threads: int
+    conflict_policy: str
+    state_path: Optional[Path]
+    pack: List[str]
+    pack_max_file_size: int
+    pack_bundle_size: int
+
+    def __init__(
+            self,
+            local_path,
+            yd_path,
+            delete,
+            delete_permanently=None,
+            threads=None,
+            conflict_policy=None,
+            state_path=None,
+            pack=None,
+            pack_max_file_size=None,
+            pack_bundle_size=None,
+            name=None,
+            target=None,
+            checksum=None,
+            hash_cache=None,
+            journal=None,
+            report_top=None,
+            report_depth=None,
+            verify_mode=None,
+            verify_cycle_days=None,
+            verify_max_bytes=None,
+            verify_max_seconds=None,
+    ):
         """
         YandexDiskRSync configuration
 
@@ -53,12 +153,86 @@ class SyncConfig:
         :type yd_path: str | Path | None
         :param delete: Can delete files
         :type delete: bool | None
+        :param delete_permanently: Delete remote files bypassing the trash
+        :type delete_permanently: bool | None
+        :param threads: Amount of concurrent remote requests
+        :type threads: int | None
+        :param conflict_policy: Two-way sync conflict resolution:
+            skip, local, remote or newer
+        :type conflict_policy: str | None
+        :param state_path: Last synchronized state file
+        :type state_path: str | Path | None
+        :param pack: Subtrees (relative to local_path), which small files
+            are packed into bundles
+        :type pack: list[str] | None
+        :param pack_max_file_size: Files up to this size are packed
+        :type pack_max_file_size: int | None
+        :param pack_bundle_size: Maximum bundle size
+        :type pack_bundle_size: int | None
+        :param name: Sync job name
+        :type name: str | None
+        :param target: Synchronization destination: disk, local or both
+        :type target: str | None
+        :param checksum: Files comparison: md5, sha256 or size
+        :type checksum: str | None
+        :param hash_cache: Cache local digests while size and mtime
+            are unchanged
+        :type hash_cache: bool | None
+        :param journal: Journal operations to resume interrupted runs
+        :type journal: bool | None
+        :param report_top: Amount of the directories and the largest items
+            in the changes preview
+        :type report_top: int | None
+        :param report_depth: Changes are aggregated by directories
+            up to this level
+        :type report_depth: int | None
+        :param verify_mode: Verification sample: rotating or random
+        :type verify_mode: str | None
+        :param verify_cycle_days: Verification runs to cover all files
+        :type verify_cycle_days: int | None
+        :param verify_max_bytes: Local bytes to read per verification run
+        :type verify_max_bytes: int | None
+        :param verify_max_seconds: Time limit of a verification run
+        :type verify_max_seconds: float | None
         """
 
         self.local_path = local_path
         self.yd_path = yd_path
 
         self.delete = delete if delete is not None else False
+        self.name = name
+        self.target = target
+        self.checksum = checksum or 'md5'
+        self.hash_cache = hash_cache if hash_cache is not None else True
+        self.journal = journal if journal is not None else True
+        self.report_top = int(report_top) if report_top is not None else 20
+        self.report_depth = int(report_depth) if report_depth is not None else 1
+        self.verify_mode = verify_mode or 'rotating'
+        self.verify_cycle_days = int(verify_cycle_days) \
+            if verify_cycle_days is not None \
+            else 7
+        self.verify_max_bytes = int(verify_max_bytes) \
+            if verify_max_bytes is not None \
+            else None
+        self.verify_max_seconds = float(verify_max_seconds) \
+            if verify_max_seconds is not None \
+            else None
+        self.delete_permanently = delete_permanently \
+            if delete_permanently is not None \
+            else False
+        self.threads = int(threads) if threads is not None else 4
+        self.conflict_policy = conflict_policy or 'skip'
+        self.state_path = Path(state_path).expanduser() if state_path else None
+        self.pack = [
+            Path(subtree).as_posix().strip('/')
+            for subtree in (pack or [])
+        ]
+        self.pack_max_file_size = int(pack_max_file_size) \
+            if pack_max_file_size is not None \
+            else 1024 * 1024
+        self.pack_bundle_size = int(pack_bundle_size) \
+            if pack_bundle_size is not None \
+            else 64 * 1024 * 1024
 
         if self.local_path:
             self.local_path = Path(self.local_path)
@@ -68,11 +242,55 @@ class SyncConfig:
     __KEY_LOCAL_PATH = 'local_path'
     __KEY_YD_PATH = 'yd_path'
     __KEY_DELETE = 'delete'
+    __KEY_DELETE_PERMANENTLY = 'delete_permanently'
+    __KEY_THREADS = 'threads'
+    __KEY_CONFLICT_POLICY = 'conflict_policy'
+    __KEY_STATE_PATH = 'state_path'
+    __KEY_PACK = 'pack'
+    __KEY_PACK_MAX_FILE_SIZE = 'pack_max_file_size'
+    __KEY_PACK_BUNDLE_SIZE = 'pack_bundle_size'
+    __KEY_NAME = 'name'
+    __KEY_TARGET = 'target'
+    __KEY_CHECKSUM = 'checksum'
+    __KEY_HASH_CACHE = 'hash_cache'
+    __KEY_JOURNAL = 'journal'
+    __KEY_REPORT_TOP = 'report_top'
+    __KEY_REPORT_DEPTH = 'report_depth'
+    __KEY_VERIFY_MODE = 'verify_mode'
+    __KEY_VERIFY_CYCLE_DAYS = 'verify_cycle_days'
+    __KEY_VERIFY_MAX_BYTES = 'verify_max_bytes'
+    __KEY_VERIFY_MAX_SECONDS = 'verify_max_seconds'
 
     __KEYS = {
         __KEY_LOCAL_PATH,
         __KEY_YD_PATH,
         __KEY_DELETE,
+        __KEY_DELETE_PERMANENTLY,
+        __KEY_THREADS,
+        __KEY_CONFLICT_POLICY,
+        __KEY_STATE_PATH,
+        __KEY_PACK,
+        __KEY_PACK_MAX_FILE_SIZE,
+        __KEY_PACK_BUNDLE_SIZE,
+        __KEY_NAME,
+        __KEY_TARGET,
+        __KEY_CHECKSUM,
+        __KEY_HASH_CACHE,
+        __KEY_JOURNAL,
+        __KEY_REPORT_TOP,
+        __KEY_REPORT_DEPTH,
+        __KEY_VERIFY_MODE,
+        __KEY_VERIFY_CYCLE_DAYS,
+        __KEY_VERIFY_MAX_BYTES,
+        __KEY_VERIFY_MAX_SECONDS,
+    }
+
+    # Job specific keys, which are not inherited from the sync section
+    __JOB_KEYS = {
+        __KEY_LOCAL_PATH,
+        __KEY_YD_PATH,
+        __KEY_STATE_PATH,
+        __KEY_NAME,
     }
 
     @classmethod
@@ -82,6 +300,15 @@ class SyncConfig:
         """
         return cls.__KEYS
 
+    @classmethod
+    def get_inherited_keys(cls):
+        """
+        Keys, which jobs inherit from the sync section
+
+        :rtype: set[str]
+        """
+        return cls.__KEYS.difference(cls.__JOB_KEYS)
+
     @classmethod
     def get_unused_keys(cls, data):
         """
@@ -106,17 +333,52 @@ class SyncConfig:
             local_path=data[cls.__KEY_LOCAL_PATH],
             yd_path=data[cls.__KEY_YD_PATH],
             delete=data[cls.__KEY_DELETE],
+            delete_permanently=data[cls.__KEY_DELETE_PERMANENTLY],
+            threads=data[cls.__KEY_THREADS],
+            conflict_policy=data[cls.__KEY_CONFLICT_POLICY],
+            state_path=data[cls.__KEY_STATE_PATH],
+            pack=data[cls.__KEY_PACK],
+            pack_max_file_size=data[cls.__KEY_PACK_MAX_FILE_SIZE],
+            pack_bundle_size=data[cls.__KEY_PACK_BUNDLE_SIZE],
+            name=data[cls.__KEY_NAME],
+            target=data[cls.__KEY_TARGET],
+            checksum=data[cls.__KEY_CHECKSUM],
+            hash_cache=data[cls.__KEY_HASH_CACHE],
+            journal=data[cls.__KEY_JOURNAL],
+            report_top=data[cls.__KEY_REPORT_TOP],
+            report_depth=data[cls.__KEY_REPORT_DEPTH],
+            verify_mode=data[cls.__KEY_VERIFY_MODE],
+            verify_cycle_days=data[cls.__KEY_VERIFY_CYCLE_DAYS],
+            verify_max_bytes=data[cls.__KEY_VERIFY_MAX_BYTES],
+            verify_max_seconds=data[cls.__KEY_VERIFY_MAX_SECONDS],
         )
 
 
 @dataclasses.dataclass(eq=False)
 class Config:
-    ydcmd: ydcmd.ydOptions
+    ydcmd_config: dict
     sync: SyncConfig
+    jobs: List[SyncConfig] = dataclasses.field(default_factory=list)
+
+    def __post_init__(self):
+        self.__ydcmd_options = None
+
+    @property
+    def ydcmd(self):
+        """
+        ydcmd options are built on the first use,
+        loading the configuration does not import ydcmd
+
+        :rtype: ydcmd.ydOptions
+        """
+        if self.__ydcmd_options is None:
+            self.__ydcmd_options = _deserialize_ydcmd_dict(self.ydcmd_config)
+        return self.__ydcmd_options
 
     __KEY_YDCMD = 'ydcmd'
     __KEY_SYNC = 'sync'
-    __KEYS = {__KEY_YDCMD, __KEY_SYNC}
+    __KEY_JOBS = 'jobs'
+    __KEYS = {__KEY_YDCMD, __KEY_SYNC, __KEY_JOBS}
 
     @classmethod
     def get_keys(cls):
@@ -145,6 +407,12 @@ class Config:
                 for field in SyncConfig.get_unused_keys(data[cls.__KEY_SYNC])
             ])
 
+        for i, job in enumerate(data.get(cls.__KEY_JOBS) or []):
+            unused_keys.extend([
+                f'{cls.__KEY_JOBS}[{i}].{field}'
+                for field in SyncConfig.get_unused_keys(job)
+            ])
+
         if cls.__KEY_YDCMD in data:
             unused_keys.extend([
                 f'{cls.__KEY_YDCMD}.{field}'
@@ -163,9 +431,19 @@ class Config:
         """
         data = collections.defaultdict(lambda: dict(), data)
 
+        inherited = {
+            key: value
+            for key, value in data[cls.__KEY_SYNC].items()
+            if key in SyncConfig.get_inherited_keys()
+        }
+
         return cls(
-            ydcmd=_deserialize_ydcmd_dict(data[cls.__KEY_YDCMD]),
+            ydcmd_config=dict(data[cls.__KEY_YDCMD]),
             sync=SyncConfig.deserialize(data[cls.__KEY_SYNC]),
+            jobs=[
+                SyncConfig.deserialize({**inherited, **job})
+                for job in data[cls.__KEY_JOBS] or []
+            ],
         )
 
 
@@ -179,6 +457,9 @@ def deserialize_yaml(file_path):
 
     for field in Config.get_unused_keys(dict_content):
         logger.warning(f'Field "{field}" in config is unused')
+    for field in _get_ydcmd_ignored_fields(dict_content.get('ydcmd') or {}):
+        logger.warning(f'Field "ydcmd.{field}" in config is used '
+                       f'only with encrypt or decrypt')
 
     return Config.deserialize(dict_content)
 
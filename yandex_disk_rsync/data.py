@@ -1,12 +1,20 @@
 import dataclasses
 import datetime
+import enum
+import itertools
 import os
+import threading
+import time
 from pathlib import Path
-from typing import Dict, Generator, List
+from typing import Callable, Dict, Generator, Iterable, List, Optional
 
-from yandex_disk_rsync import ydcmd
 from yandex_disk_rsync.log import logger
-from yandex_disk_rsync.utils import human_readable_size, file_md5
+from yandex_disk_rsync.hashing import file_digests
+from yandex_disk_rsync.profiling import counted
+from yandex_disk_rsync.transfer import PART_SUFFIX, api_query
+from yandex_disk_rsync.utils import human_readable_size, lazy_import, ydcmd
+
+futures = lazy_import('concurrent.futures')
 
 
 @dataclasses.dataclass
@@ -67,36 +75,199 @@ Unlimited auto-upload enabled : {self.unlimited_autoupload_enabled}
 Revision                      : {self.revision.isoformat()}'''
 
 
+class Checksum(enum.Enum):
+    Md5 = 'md5'
+    Sha256 = 'sha256'
+    Size = 'size'
+
+    def algorithms(self):
+        """
+        Local digests to compute, md5 is always required by the disk
+        """
+        return {
+            Checksum.Md5: ('md5',),
+            Checksum.Sha256: ('md5', 'sha256'),
+            Checksum.Size: (),
+        }[self]
+
+
 @dataclasses.dataclass
 class FileBriefData:
     path: str
-    md5: str
+    md5: Optional[str]
+    size: Optional[int] = None
+    mtime: Optional[float] = None
+    sha256: Optional[str] = None
+
+
+def same_content(
+        first: FileBriefData,
+        second: FileBriefData,
+        checksum: Checksum = Checksum.Md5,
+) -> bool:
+    """
+    Compare by the checksum, falls back to md5 and size,
+    if one of the sides does not have it
+    """
+    for kind in (checksum, Checksum.Md5, Checksum.Size):
+        first_value = getattr(first, kind.value)
+        second_value = getattr(second, kind.value)
+        if first_value is not None and second_value is not None:
+            return first_value == second_value
+    return False
 
 
 @dataclasses.dataclass
 class YdFileBriefData(FileBriefData):
-    direct_url: str
+    direct_url: Optional[str] = None
+
+
+def _parse_datetime(value) -> Optional[datetime.datetime]:
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return value
+
+
+@dataclasses.dataclass
+class YdResource:
+    """
+    Disk resource, as listed by the API
+    """
+    name: str
+    type: str
+    md5: Optional[str] = None
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+    modified: Optional[datetime.datetime] = None
+    file: Optional[str] = None
+
+    @classmethod
+    def deserialize(cls, data):
+        """
+        :type data: dict
+        :rtype: YdResource
+        """
+        return cls(
+            name=data['name'],
+            type=data['type'],
+            md5=data.get('md5'),
+            sha256=data.get('sha256'),
+            size=data.get('size'),
+            modified=_parse_datetime(data.get('modified')),
+            file=data.get('file'),
+        )
+
+
+def _timestamp(value) -> Optional[float]:
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return None
+
+
+@counted
+def yd_list(options, disk_url):
+    """
+    Directory listing through the shared HTTP session,
+    paged by the ydcmd limit option
+
+    :type disk_url: str
+    :rtype: dict[str, YdResource]
+    """
+    limit = int(getattr(options, 'limit', 100))
+    result: Dict[str, YdResource] = {}
+    offset = 0
+    while True:
+        data = api_query(
+            options,
+            'GET',
+            f'{options.baseurl}/resources',
+            {'path': disk_url, 'limit': limit, 'offset': offset},
+        ) or {}
+
+        embedded = data.get('_embedded')
+        if embedded is None:
+            resource = YdResource.deserialize(data)
+            return {resource.name: resource}
+
+        items = embedded.get('items', [])
+        for item in items:
+            resource = YdResource.deserialize(item)
+            result[resource.name] = resource
+
+        if len(items) < limit:
+            return result
+        offset += limit
+
+
+class YdListCache:
+    """
+    Remote directory listings, shared by the sync jobs of one process
+    """
+
+    def __init__(self):
+        self.__listings: Dict[str, dict] = {}
+        self.__lock = threading.Lock()
+
+    def list(self, options, disk_url: str) -> dict:
+        with self.__lock:
+            if disk_url in self.__listings:
+                logger.debug(f"Cached listing of {disk_url}")
+                return self.__listings[disk_url]
+
+        file_list = yd_list(options, disk_url)
+        with self.__lock:
+            self.__listings[disk_url] = file_list
+        return file_list
+
+    def invalidate(self, disk_url: str) -> None:
+        """
+        Forget the directory, its subdirectories and its parents
+        """
+        with self.__lock:
+            for key in list(self.__listings):
+                if key == disk_url \
+                        or key.startswith(f'{disk_url}/') \
+                        or disk_url.startswith(f'{key}/'):
+                    del self.__listings[key]
 
 
 def yd_listdir(
         options,
         remote_path: str,
-        relative_path: str = ''
+        relative_path: str = '',
+        cache: Optional[YdListCache] = None,
+        path_filter: Optional[Callable[[str], bool]] = None,
 ) -> Generator[YdFileBriefData, None, None]:
+    """
+    :param path_filter: Predicate for the top level names
+    """
     disk_url = f'disk:/{remote_path}/{relative_path}' \
         if relative_path \
         else f'disk:/{remote_path}'
 
     logger.debug(f"Processing {disk_url}")
-    file_list = ydcmd.yd_list(options, disk_url)
+    file_list = cache.list(options, disk_url) \
+        if cache is not None \
+        else yd_list(options, disk_url)
 
     for key, item in file_list.items():
+        if path_filter is not None and not path_filter(key):
+            continue
+
         new_relative_path = f'{relative_path}/{key}' if relative_path else key
         if item.type == 'file':
             # Did not use Path due to win/linux different delimiters
             yield YdFileBriefData(
                 path=new_relative_path,
                 md5=item.md5,
+                size=item.size,
+                mtime=_timestamp(item.modified),
+                sha256=getattr(item, 'sha256', None),
                 direct_url=item.file,
             )
             continue
@@ -105,7 +276,8 @@ def yd_listdir(
             for inner_item in yd_listdir(
                     options,
                     remote_path,
-                    new_relative_path
+                    new_relative_path,
+                    cache,
             ):
                 yield inner_item
 
@@ -115,26 +287,91 @@ def yd_listdir(
 
 
 # Relative path must be determined and hashable
-def local_listdir(options, local_path: Path, relative_path: str = ''):
+def _local_file(file_path: Path, relative_path: str, checksum: Checksum, hash_cache=None):
+    """
+    :type hash_cache: yandex_disk_rsync.hash_cache.HashCache | None
+    :rtype: FileBriefData
+    """
+    stat = os.stat(file_path)
+    digests = None
+    if checksum.algorithms() and hash_cache is not None:
+        digests = hash_cache.get(file_path, stat, checksum.algorithms())
+    if checksum.algorithms() and digests is None:
+        digests = file_digests(file_path, checksum.algorithms())
+        if hash_cache is not None:
+            hash_cache.put(file_path, stat, digests)
+    return FileBriefData(
+        path=relative_path,
+        md5=digests.md5 if digests else None,
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        sha256=digests.sha256 if digests else None,
+    )
+
+
+def local_digests(
+        local_path: Path,
+        relative_paths: Iterable[str],
+        checksum: Checksum = Checksum.Md5,
+        hash_cache=None,
+) -> Dict[str, FileBriefData]:
+    """
+    Hash the files, listed without digests by local_listdir.
+    Only the files compared with the other side are hashed,
+    new files are hashed by the upload stream
+
+    :type hash_cache: yandex_disk_rsync.hash_cache.HashCache | None
+    """
+    return {
+        relative_path: _local_file(
+            local_path / relative_path,
+            relative_path,
+            checksum,
+            hash_cache,
+        )
+        for relative_path in relative_paths
+    }
+
+
+def local_listdir(
+        options,
+        local_path: Path,
+        relative_path: str = '',
+        path_filter: Optional[Callable[[str], bool]] = None,
+        checksum: Checksum = Checksum.Md5,
+        hash_cache=None,
+):
+    """
+    :param path_filter: Predicate for the top level names
+    :param checksum: Defines digests to compute
+    :param hash_cache: Digests of unchanged files are taken from the cache
+    :type hash_cache: yandex_disk_rsync.hash_cache.HashCache | None
+    """
     complete_path = local_path / relative_path \
         if relative_path \
         else local_path
 
     for path in os.listdir(complete_path):
+        if path_filter is not None and not path_filter(path):
+            continue
+
         new_complete_path = complete_path / str(path)
         new_relative_path = f'{relative_path}/{path}' if relative_path else path
         if os.path.isfile(new_complete_path):
-            yield FileBriefData(
-                path=new_relative_path,
-                md5=file_md5(new_complete_path),
-            )
+            if path.endswith(PART_SUFFIX):
+                logger.debug(f"Skipping partial download {new_complete_path}")
+                continue
+
+            yield _local_file(new_complete_path, new_relative_path, checksum, hash_cache)
             continue
 
         if os.path.isdir(new_complete_path):
             for inner_item in local_listdir(
                     options,
                     local_path,
-                    new_relative_path
+                    new_relative_path,
+                    checksum=checksum,
+                    hash_cache=hash_cache,
             ):
                 yield inner_item
 
@@ -146,17 +383,69 @@ def local_listdir(options, local_path: Path, relative_path: str = ''):
 def yd_exists(options, remote_path):
     """
     :type remote_path: Path | str
+    :raises ydcmd.ydError: API errors other than the missing resource,
+        a transient failure must not look like a deletion
     """
     remote_path_str = Path(remote_path).as_posix()
 
     try:
-        ydcmd.yd_list(options, remote_path_str)
-    except ydcmd.ydError as _:
-        return False
+        api_query(
+            options,
+            'GET',
+            f'{options.baseurl}/resources',
+            {'path': remote_path_str, 'fields': 'path'},
+        )
+    except ydcmd.ydError as e:
+        if getattr(e, 'errno', None) == 404:
+            return False
+        raise
     else:
         return True
 
 
+def yd_file_brief(options, remote_path):
+    """
+    :type remote_path: str
+    :return: Digests, size and modification time of the remote file
+        or None, if it does not exist
+    :rtype: YdFileBriefData | None
+    :raises ydcmd.ydError: Other API errors, e.g. an expired token
+    """
+    try:
+        result = api_query(
+            options,
+            'GET',
+            f'{options.baseurl}/resources',
+            {'path': remote_path, 'fields': 'md5,sha256,size,modified'},
+        )
+    except ydcmd.ydError as e:
+        if getattr(e, 'errno', None) == 404:
+            return None
+        raise
+
+    if not result:
+        return None
+
+    return YdFileBriefData(
+        path=remote_path,
+        md5=result.get('md5'),
+        size=result.get('size'),
+        mtime=_timestamp(_parse_datetime(result.get('modified'))),
+        sha256=result.get('sha256'),
+    )
+
+
+def yd_file_md5(options, remote_path):
+    """
+    :type remote_path: str
+    :return: md5 of the remote file or None, if it does not exist
+    :rtype: str | None
+    """
+    item = yd_file_brief(options, remote_path)
+    return item.md5 if item else None
+
+
+@counted
 def yd_mkdir_recursive(options, remote_path):
     """
     :type remote_path: Path | str
@@ -178,4 +467,146 @@ def yd_mkdir_recursive(options, remote_path):
         logger.debug(f"- {path}")
 
     for path_str in reversed(to_create):
-        ydcmd.yd_create(options, path_str)
+        try:
+            api_query(options, 'PUT', f'{options.baseurl}/resources', {'path': path_str})
+        except ydcmd.ydError as e:
+            # Created concurrently
+            if getattr(e, 'errno', None) != 409:
+                raise
+
+
+def _yd_delete_request(options, remote_path, permanently):
+    """
+    Request the resource deletion without waiting for its completion
+
+    :type remote_path: str
+    :type permanently: bool
+    :return: Async operation link or None, if deleted immediately
+    :rtype: dict | None
+    """
+    result = api_query(
+        options,
+        'DELETE',
+        f'{options.baseurl}/resources',
+        {
+            'path': remote_path,
+            'permanently': 'true' if permanently else 'false',
+        },
+    )
+    if result and 'href' in result:
+        return result
+
+    return None
+
+
+def _yd_operation_status(options, link):
+    """
+    :type link: dict
+    :return: 'success', 'failed' or 'in-progress'
+    :rtype: str
+    """
+    result = api_query(
+        options,
+        link.get('method', 'GET'),
+        link['href'],
+        {},
+    )
+    return result.get('status', 'failed') if result else 'failed'
+
+
+def _bounded_map(executor, func, items, limit: int):
+    """
+    executor.map with at most limit calls at once, the shared pool
+    may be larger. Results are yielded in the completion order
+    """
+    items = iter(items)
+    running = {executor.submit(func, item) for item in itertools.islice(items, max(1, limit))}
+    while running:
+        done, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+        running.update(executor.submit(func, item) for item in itertools.islice(items, len(done)))
+
+
+def yd_delete_batch(
+        options,
+        remote_paths,
+        permanently=False,
+        threads=4,
+        executor=None,
+):
+    """
+    Delete remote resources concurrently.
+    Async operations, returned by the API, are polled in bulk
+    until they finish or the request timeout with all its retries expires
+
+    :type remote_paths: list[str]
+    :type permanently: bool
+    :param threads: Limit of the concurrent requests, also in the shared pool
+    :type threads: int
+    :param executor: Shared pool
+    :type executor: concurrent.futures.Executor | None
+    :return: Paths, which have not been deleted
+    :rtype: list[str]
+    """
+    if executor is None:
+        with futures.ThreadPoolExecutor(max(1, threads)) as executor:
+            return yd_delete_batch(
+                options,
+                remote_paths,
+                permanently=permanently,
+                threads=threads,
+                executor=executor,
+            )
+
+    failed: List[str] = []
+    pending: Dict[str, dict] = {}
+
+    def request(path):
+        try:
+            return path, _yd_delete_request(options, path, permanently)
+        except ydcmd.ydError as e:
+            # Already deleted, e.g. by the interrupted run
+            if getattr(e, 'errno', None) == 404:
+                logger.info(f"disk:{path} is already deleted")
+                return path, None
+            logger.error(f"Unable to delete disk:{path}: {e}")
+            return path, e
+
+    def status(item):
+        path, link = item
+        try:
+            return path, _yd_operation_status(options, link)
+        except ydcmd.ydError as e:
+            logger.error(f"Unable to get operation status for disk:{path}: {e}")
+            return path, 'failed'
+
+    for path, link in _bounded_map(executor, request, remote_paths, threads):
+        if isinstance(link, Exception):
+            failed.append(path)
+        elif link is not None:
+            pending[path] = link
+
+    if pending:
+        logger.info(f"Waiting for {len(pending)} async delete operations")
+
+    deadline = time.monotonic() + options.timeout * (options.retries + 1)
+    while pending:
+        if time.monotonic() >= deadline:
+            logger.error(f"{len(pending)} async delete operations "
+                         f"did not finish in time")
+            failed.extend(pending)
+            break
+
+        time.sleep(options.poll)
+        for path, state in _bounded_map(executor, status, list(pending.items()), threads):
+            if state == 'in-progress':
+                continue
+
+            del pending[path]
+            if state != 'success':
+                logger.error(f"Delete operation for disk:{path} "
+                             f"finished with status '{state}'")
+                failed.append(path)
+
+    return failed
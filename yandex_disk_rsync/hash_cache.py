@@ -0,0 +1,122 @@
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+
+from yandex_disk_rsync.hashing import Digests
+from yandex_disk_rsync.log import logger
+from yandex_disk_rsync.utils import cache_path, lazy_import
+
+sqlite3 = lazy_import('sqlite3')
+
+# Seconds to wait for the lock of another process
+_BUSY_TIMEOUT = 10.0
+
+
+def default_hash_cache_path() -> Path:
+    return cache_path() / 'hashes.sqlite3'
+
+
+class HashCache:
+    """
+    Local file digests, valid while the file size and mtime are unchanged
+    """
+
+    def __init__(self, file_path: Optional[Path] = None, timeout: float = _BUSY_TIMEOUT):
+        """
+        Shared by concurrent processes: every update is committed
+        in its own short transaction of the WAL journal,
+        updates, which wait for the lock too long, are skipped
+        """
+        file_path = file_path or default_hash_cache_path()
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(
+            str(file_path),
+            timeout=timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('PRAGMA synchronous=NORMAL')
+        self.__connection.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                md5 TEXT,
+                sha256 TEXT
+            )
+        ''')
+        logger.debug(f'Using hash cache "{file_path}"')
+
+    @staticmethod
+    def __key(path) -> str:
+        return str(Path(path).resolve())
+
+    def __execute(self, sql: str, parameters: tuple):
+        """
+        :return: The cursor or None, if the database is locked for too long
+        """
+        try:
+            with self.__lock:
+                return self.__connection.execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            logger.warning(f'Hash cache is not available: {e}')
+            return None
+
+    def get(
+            self,
+            path,
+            stat: os.stat_result,
+            algorithms: Iterable[str],
+    ) -> Optional[Digests]:
+        """
+        :return: Cached digests, if the file is unchanged
+            and all algorithms are cached
+        """
+        cursor = self.__execute(
+            'SELECT size, mtime_ns, md5, sha256 FROM files WHERE path = ?',
+            (self.__key(path),),
+        )
+        row = cursor.fetchone() if cursor is not None else None
+        if row is None:
+            return None
+
+        size, mtime_ns, md5, sha256 = row
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+
+        digests = Digests(size=size, md5=md5, sha256=sha256)
+        if any(getattr(digests, name) is None for name in algorithms):
+            return None
+        return digests
+
+    def put(self, path, stat: os.stat_result, digests: Digests) -> None:
+        self.__execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+            (
+                self.__key(path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                digests.md5,
+                digests.sha256,
+            ),
+        )
+
+    def remove(self, path) -> None:
+        self.__execute(
+            'DELETE FROM files WHERE path = ?',
+            (self.__key(path),),
+        )
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
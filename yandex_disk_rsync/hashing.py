@@ -0,0 +1,175 @@
+import argparse
+import dataclasses
+import hashlib
+import mmap
+import os
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+
+from yandex_disk_rsync.profiling import counted
+
+DEFAULT_ALGORITHMS = ('md5', 'sha256')
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+# Files starting from this size are mapped into memory
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+
+@dataclasses.dataclass
+class Digests:
+    size: int
+    md5: Optional[str] = None
+    sha256: Optional[str] = None
+
+
+class StreamHasher:
+    """
+    Digests and the size of the bytes passing through a stream
+    """
+
+    def __init__(self, algorithms: Iterable[str] = DEFAULT_ALGORITHMS):
+        self.__hashers = {name: hashlib.new(name) for name in algorithms}
+        self.size = 0
+
+    def update(self, chunk) -> None:
+        for hasher in self.__hashers.values():
+            hasher.update(chunk)
+        self.size += len(chunk)
+
+    def digests(self) -> Digests:
+        return Digests(
+            size=self.size,
+            **{name: hasher.hexdigest() for name, hasher in self.__hashers.items()},
+        )
+
+
+def aligned_buffer_size(size: int) -> int:
+    """
+    Round the buffer size up to the memory page size
+    """
+    page = mmap.PAGESIZE
+    return max(page, (size + page - 1) // page * page)
+
+
+@counted
+def file_digests(
+        path,
+        algorithms: Iterable[str] = DEFAULT_ALGORITHMS,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        use_mmap: Optional[bool] = None,
+) -> Digests:
+    """
+    Compute all digests and the size in a single pass over the file
+
+    :type path: str | Path
+    :param algorithms: Subset of md5 and sha256
+    :param use_mmap: Map the file into memory instead of readinto.
+        By default, only files from MMAP_THRESHOLD are mapped
+    """
+    hasher = StreamHasher(algorithms)
+    buffer_size = aligned_buffer_size(buffer_size)
+
+    with open(path, 'rb', buffering=0) as file:
+        file_size = os.fstat(file.fileno()).st_size
+        if use_mmap is None:
+            use_mmap = file_size >= MMAP_THRESHOLD
+
+        if use_mmap and file_size > 0:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                    memoryview(mapped) as view:
+                for offset in range(0, len(view), buffer_size):
+                    hasher.update(view[offset:offset + buffer_size])
+        else:
+            buffer = bytearray(buffer_size)
+            with memoryview(buffer) as view:
+                while True:
+                    read = file.readinto(buffer)
+                    if not read:
+                        break
+                    hasher.update(view[:read])
+
+    return hasher.digests()
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    strategy: str
+    buffer_size: int
+    seconds: float
+    size: int
+
+    @property
+    def throughput(self) -> float:
+        """
+        MiB per second
+        """
+        return self.size / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f'{self.strategy:<9} {self.buffer_size // 1024:>8} KiB '
+                f'{self.seconds:>8.3f} s {self.throughput:>10.1f} MiB/s')
+
+
+def benchmark(
+        path,
+        buffer_sizes: Sequence[int] = (16 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024),
+        algorithms: Iterable[str] = DEFAULT_ALGORITHMS,
+        repeat: int = 3,
+) -> List[BenchmarkResult]:
+    """
+    Compare buffer sizes and readinto/mmap strategies on the file.
+    The best of the repeats is reported, so the page cache is warm
+    """
+    algorithms = tuple(algorithms)
+    results: List[BenchmarkResult] = []
+    for use_mmap in (False, True):
+        for buffer_size in buffer_sizes:
+            best = None
+            size = 0
+            for _ in range(repeat):
+                started = time.perf_counter()
+                size = file_digests(path, algorithms, buffer_size, use_mmap).size
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+
+            results.append(BenchmarkResult(
+                strategy='mmap' if use_mmap else 'readinto',
+                buffer_size=aligned_buffer_size(buffer_size),
+                seconds=best,
+                size=size,
+            ))
+    return results
+
+
+def _benchmark_main():
+    parser = argparse.ArgumentParser(
+        description='Hashing micro-benchmark: buffer sizes and read strategies',
+    )
+    parser.add_argument('path', type=Path)
+    parser.add_argument(
+        '--buffer-kib',
+        type=int,
+        nargs='+',
+        default=[16, 256, 1024, 4096],
+        dest='buffer_kib',
+    )
+    parser.add_argument(
+        '--algorithms',
+        nargs='+',
+        default=list(DEFAULT_ALGORITHMS),
+        choices=list(DEFAULT_ALGORITHMS),
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for result in benchmark(
+            args.path,
+            [kib * 1024 for kib in args.buffer_kib],
+            args.algorithms,
+            args.repeat,
+    ):
+        print(result)
+
+
+if __name__ == '__main__':
+    _benchmark_main()
@@ -0,0 +1,189 @@
+import dataclasses
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from yandex_disk_rsync.log import logger
+from yandex_disk_rsync.utils import cache_path, \
+    open_text_read, \
+    open_text_write, \
+    sync_pair_digest
+
+JOURNAL_VERSION = 1
+
+_KIND_PLAN = 'plan'
+_KIND_BEGIN = 'begin'
+_KIND_DONE = 'done'
+
+
+def default_journal_path(local_path, yd_path, shard=None):
+    """
+    :type local_path: Path
+    :type yd_path: str
+    :param shard: Shards of one tree have separate journals
+    :type shard: yandex_disk_rsync.shard.ShardSpec | None
+    :rtype: Path
+    """
+    name = sync_pair_digest(local_path, yd_path)
+    if shard is not None:
+        name = f'{name}-{shard.tag}'
+    return cache_path() / 'journal' / f'{name}.jsonl'
+
+
+@dataclasses.dataclass
+class JournalPlan:
+    """
+    Unfinished run, restored from the journal
+    """
+    operations: List[dict]
+    meta: Dict[str, str]
+    begun: Set[int]
+    done: Set[int]
+
+    @property
+    def in_flight(self) -> Set[int]:
+        return self.begun.difference(self.done)
+
+    @property
+    def remaining(self) -> int:
+        return len(self.operations) - len(self.done)
+
+
+class Journal:
+    """
+    Write-ahead journal of the planned and completed sync operations.
+    The plan and the begin records are synced to the disk before
+    the operations start, the done records are flushed in batches
+    """
+
+    def __init__(
+            self,
+            file_path: Path,
+            batch_size: int = 256,
+            flush_interval: float = 2.0,
+    ):
+        self.file_path = file_path
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval
+        self.__file = None
+        self.__buffer: List[str] = []
+        self.__last_flush = time.monotonic()
+        self.__done: Set[int] = set()
+
+    def load(self) -> Optional[JournalPlan]:
+        """
+        :return: The unfinished plan or None, if there is nothing to resume
+        """
+        if not self.file_path.exists():
+            return None
+
+        plan: Optional[JournalPlan] = None
+        with open_text_read(self.file_path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last record may be torn by the crash
+                    logger.warning(f'Skipping broken journal record in "{self.file_path}"')
+                    continue
+
+                kind = record.get('kind')
+                if kind == _KIND_PLAN:
+                    if record.get('version') != JOURNAL_VERSION:
+                        logger.warning("Unsupported journal version, ignoring it")
+                        return None
+                    plan = JournalPlan(
+                        operations=record['operations'],
+                        meta=record['meta'],
+                        begun=set(),
+                        done=set(),
+                    )
+                elif plan is not None and kind == _KIND_BEGIN:
+                    plan.begun.update(record['ids'])
+                elif plan is not None and kind == _KIND_DONE:
+                    plan.done.update(record['ids'])
+
+        self.__done = set(plan.done) if plan else set()
+        return plan
+
+    def start(self, operations: List[dict], meta: Dict[str, str]) -> None:
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.__done = set()
+        self.__file = open_text_write(self.file_path)
+        self.__file.write(json.dumps({
+            'kind': _KIND_PLAN,
+            'version': JOURNAL_VERSION,
+            'meta': meta,
+            'operations': operations,
+        }) + '\n')
+        self.__sync()
+
+    def resume(self) -> None:
+        self.__file = open(self.file_path, 'at', encoding='UTF-8', newline='\n')
+        # Separate records from the possibly torn last line
+        self.__file.write('\n')
+
+    def is_done(self, operation_id: int) -> bool:
+        return operation_id in self.__done
+
+    def begin(self, *operation_ids: int) -> None:
+        """
+        Synced immediately: an operation without the begin record
+        is never in flight
+        """
+        self.__record(_KIND_BEGIN, operation_ids)
+        self.flush()
+
+    def done(self, *operation_ids: int) -> None:
+        self.__done.update(operation_ids)
+        self.__record(_KIND_DONE, operation_ids)
+
+    def __record(self, kind: str, operation_ids) -> None:
+        if not operation_ids or self.__file is None:
+            return
+
+        self.__buffer.append(json.dumps({'kind': kind, 'ids': list(operation_ids)}))
+        if len(self.__buffer) >= self.__batch_size \
+                or time.monotonic() - self.__last_flush >= self.__flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.__file is None or not self.__buffer:
+            return
+
+        self.__file.write('\n'.join(self.__buffer) + '\n')
+        self.__buffer = []
+        self.__sync()
+
+    def __sync(self) -> None:
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__last_flush = time.monotonic()
+
+    def close(self) -> None:
+        """
+        Flush the progress, the journal stays for the resume
+        """
+        if self.__file is None:
+            return
+
+        self.flush()
+        self.__file.close()
+        self.__file = None
+
+    def complete(self) -> None:
+        """
+        All operations are done, the journal is removed
+        """
+        self.discard()
+
+    def discard(self) -> None:
+        """
+        Drop the stale or failed plan, the next run plans from scratch
+        """
+        self.close()
+        self.__done = set()
+        if self.file_path.exists():
+            self.file_path.unlink()
@@ -21,9 +21,21 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + format + reset
     }
 
+    def __init__(self):
+        super().__init__()
+        # Formatters are reused, building them per record is expensive
+        self.__formatters = {
+            level: logging.Formatter(log_fmt)
+            for level, log_fmt in self.FORMATS.items()
+        }
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.__formatters.get(record.levelno)
+        if formatter is None:
+            formatter = self.__formatters.setdefault(
+                record.levelno,
+                logging.Formatter(self.FORMATS.get(record.levelno)),
+            )
         return formatter.format(record)
 
 
@@ -0,0 +1,372 @@
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from yandex_disk_rsync.data import FileBriefData, \
+    same_content, \
+    yd_mkdir_recursive, \
+    yd_delete_batch
+from yandex_disk_rsync.log import logger
+from yandex_disk_rsync.transfer import download_file, upload_file
+from yandex_disk_rsync.utils import ask_to_continue, \
+    open_text_read, \
+    open_text_write, \
+    lazy_import, \
+    ydcmd
+
+tarfile = lazy_import('tarfile')
+
+PACK_DIR_NAME = '.ydsync-pack'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# A bundle is closed on an anchor file after reaching this part of the size
+_MIN_BUNDLE_PART = 4
+# Every N-th path (in average) is an anchor
+_ANCHOR_MODULO = 16
+
+
+@dataclasses.dataclass
+class Bundle:
+    """
+    Tar archive with small files. Paths are relative to the packed subtree
+    """
+    name: str
+    files: Dict[str, FileBriefData]
+
+    @property
+    def digest(self) -> str:
+        """
+        Content digest, independent of the tar layout.
+        Without md5 (the size checksum) the modification time is included,
+        so same-size edits are not missed
+        """
+        hash_md5 = hashlib.md5()
+        for path in sorted(self.files):
+            item = self.files[path]
+            mtime = item.mtime if item.md5 is None else None
+            hash_md5.update(f'{path}\0{item.md5}\0{item.size}\0{mtime}\n'.encode('UTF-8'))
+        return hash_md5.hexdigest()
+
+    @property
+    def size(self) -> int:
+        return sum(item.size or 0 for item in self.files.values())
+
+
+@dataclasses.dataclass
+class PackPlan:
+    subtree: str
+    upload: bool
+    manifest: Dict[str, Bundle]
+    transfer: List[Bundle]
+    # Stale bundle names for the upload, local relative paths for the download
+    delete: List[str]
+
+    def __str__(self):
+        direction = 'upload' if self.upload else 'download'
+        return (f'{self.subtree}: {len(self.transfer)} of '
+                f'{len(self.manifest)} bundles to {direction}, '
+                f'{len(self.delete)} to delete')
+
+
+def _path_hash(path: str) -> int:
+    return int(hashlib.md5(path.encode('UTF-8')).hexdigest()[:8], 16)
+
+
+def _bundle_name(first_path: str) -> str:
+    return f'bundle-{hashlib.md5(first_path.encode("UTF-8")).hexdigest()[:16]}.tar'
+
+
+def plan_bundles(files: Dict[str, FileBriefData], bundle_size: int) -> List[Bundle]:
+    """
+    Split files into size-bounded bundles.
+    Boundaries depend on the paths (anchors), so a changed or a new file
+    affects only its own bundle
+    """
+    bundles: List[Bundle] = []
+    current: Dict[str, FileBriefData] = {}
+    current_size = 0
+
+    def close():
+        nonlocal current, current_size
+        if current:
+            bundles.append(Bundle(name=_bundle_name(next(iter(current))), files=current))
+        current = {}
+        current_size = 0
+
+    for path in sorted(files):
+        item = files[path]
+        size = item.size or 0
+        if current and current_size + size > bundle_size:
+            close()
+
+        current[path] = item
+        current_size += size
+
+        if current_size >= bundle_size // _MIN_BUNDLE_PART \
+                and _path_hash(path) % _ANCHOR_MODULO == 0:
+            close()
+
+    close()
+    return bundles
+
+
+def _in_subtree(relative_path: str, subtree: str) -> bool:
+    return relative_path.startswith(f'{subtree}/')
+
+
+def split_packed(
+        stats: Dict[str, FileBriefData],
+        subtree: str,
+        max_file_size: int,
+) -> Tuple[Dict[str, FileBriefData], Dict[str, FileBriefData]]:
+    """
+    :return: Small files of the subtree (paths relative to the subtree)
+        and the rest of files
+    """
+    packed: Dict[str, FileBriefData] = {}
+    rest: Dict[str, FileBriefData] = {}
+    prefix_len = len(subtree) + 1
+
+    for key, item in stats.items():
+        if _in_subtree(key, subtree) and (item.size or 0) <= max_file_size:
+            packed_key = key[prefix_len:]
+            packed[packed_key] = dataclasses.replace(item, path=packed_key)
+        else:
+            rest[key] = item
+
+    return packed, rest
+
+
+def exclude_pack_dir(
+        stats: Dict[str, FileBriefData],
+        subtree: str,
+) -> Dict[str, FileBriefData]:
+    pack_dir = f'{subtree}/{PACK_DIR_NAME}'
+    return {
+        key: item
+        for key, item in stats.items()
+        if not _in_subtree(key, pack_dir)
+    }
+
+
+def _serialize_manifest(manifest: Dict[str, Bundle]) -> dict:
+    return {
+        'version': MANIFEST_VERSION,
+        'bundles': {
+            name: {
+                'digest': bundle.digest,
+                'files': {
+                    path: {
+                        'md5': item.md5,
+                        'size': item.size,
+                        'mtime': item.mtime,
+                    }
+                    for path, item in bundle.files.items()
+                },
+            }
+            for name, bundle in manifest.items()
+        },
+    }
+
+
+def _deserialize_manifest(data: dict) -> Dict[str, Bundle]:
+    if data.get('version') != MANIFEST_VERSION:
+        logger.warning("Unsupported pack manifest version, ignoring it")
+        return {}
+
+    return {
+        name: Bundle(
+            name=name,
+            files={
+                path: FileBriefData(
+                    path=path,
+                    md5=item['md5'],
+                    size=item.get('size'),
+                    mtime=item.get('mtime'),
+                )
+                for path, item in bundle['files'].items()
+            },
+        )
+        for name, bundle in data['bundles'].items()
+    }
+
+
+def _remote_pack_dir(remote_root_path: str, subtree: str) -> str:
+    return f'{remote_root_path}/{subtree}/{PACK_DIR_NAME}'
+
+
+def _download_manifest(options, remote_dir: str) -> Dict[str, Bundle]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manifest_path = Path(tmp_dir) / MANIFEST_NAME
+        try:
+            download_file(options, f'{remote_dir}/{MANIFEST_NAME}', manifest_path, algorithms=())
+        except ydcmd.ydError as e:
+            # Other errors must not look like an empty pack:
+            # all bundles would be uploaded again and the old ones orphaned
+            if getattr(e, 'errno', None) != 404:
+                raise
+            logger.info(f"No pack manifest in disk:{remote_dir}")
+            return {}
+
+        with open_text_read(manifest_path) as file:
+            return _deserialize_manifest(json.load(file))
+
+
+def write_bundle(bundle: Bundle, source_dir: Path, bundle_path: Path) -> None:
+    with tarfile.open(bundle_path, 'w') as tar:
+        for path in sorted(bundle.files):
+            tar.add(str(source_dir / path), arcname=path, recursive=False)
+
+
+def extract_bundle(
+        bundle_path: Path,
+        target_dir: Path,
+        paths: List[str],
+) -> None:
+    """
+    Extract only the specified paths, which must stay inside the target
+    """
+    target_dir = target_dir.resolve()
+    wanted = set(paths)
+
+    with tarfile.open(bundle_path, 'r') as tar:
+        for member in tar:
+            if member.name not in wanted or not member.isfile():
+                continue
+
+            file_path = (target_dir / member.name).resolve()
+            if target_dir not in file_path.parents:
+                logger.error(f"Skipping unsafe bundle member {member.name}")
+                continue
+
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            with tar.extractfile(member) as src, open(file_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.utime(file_path, (member.mtime, member.mtime))
+
+
+def plan_pack_upload(
+        options,
+        subtree: str,
+        local_files: Dict[str, FileBriefData],
+        remote_root_path: str,
+        bundle_size: int,
+) -> PackPlan:
+    remote_manifest = _download_manifest(
+        options,
+        _remote_pack_dir(remote_root_path, subtree),
+    )
+    bundles = plan_bundles(local_files, bundle_size)
+
+    return PackPlan(
+        subtree=subtree,
+        upload=True,
+        manifest={bundle.name: bundle for bundle in bundles},
+        transfer=[
+            bundle
+            for bundle in bundles
+            if bundle.name not in remote_manifest
+            or remote_manifest[bundle.name].digest != bundle.digest
+        ],
+        delete=sorted(
+            set(remote_manifest).difference(bundle.name for bundle in bundles)
+        ),
+    )
+
+
+def plan_pack_download(
+        options,
+        subtree: str,
+        local_files: Dict[str, FileBriefData],
+        remote_root_path: str,
+        can_delete: bool,
+) -> PackPlan:
+    remote_manifest = _download_manifest(
+        options,
+        _remote_pack_dir(remote_root_path, subtree),
+    )
+
+    transfer: List[Bundle] = []
+    remote_paths = set()
+    for bundle in remote_manifest.values():
+        remote_paths.update(bundle.files)
+        changed = {
+            path: item
+            for path, item in bundle.files.items()
+            if path not in local_files or not same_content(local_files[path], item)
+        }
+        if changed:
+            transfer.append(Bundle(name=bundle.name, files=changed))
+
+    return PackPlan(
+        subtree=subtree,
+        upload=False,
+        manifest=remote_manifest,
+        transfer=transfer,
+        delete=sorted(set(local_files).difference(remote_paths))
+        if can_delete and remote_manifest
+        else [],
+    )
+
+
+def apply_pack(
+        options,
+        plan: PackPlan,
+        local_root_path: Path,
+        remote_root_path: str,
+        threads: int = 4,
+        executor=None,
+) -> None:
+    local_dir = local_root_path.resolve() / plan.subtree
+    remote_dir = _remote_pack_dir(remote_root_path, plan.subtree)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not plan.upload:
+            for bundle in plan.transfer:
+                bundle_path = Path(tmp_dir) / bundle.name
+                logger.info(f"Extract {len(bundle.files)} files "
+                            f"from disk:{remote_dir}/{bundle.name}")
+                download_file(options, f'{remote_dir}/{bundle.name}', bundle_path, algorithms=())
+                extract_bundle(bundle_path, local_dir, list(bundle.files))
+                bundle_path.unlink()
+
+            for path in plan.delete:
+                logger.warning(f"Removing {local_dir / path}")
+                ask_to_continue()
+                (local_dir / path).unlink(missing_ok=True)
+            return
+
+        if plan.transfer:
+            yd_mkdir_recursive(options, remote_dir)
+
+        for bundle in plan.transfer:
+            bundle_path = Path(tmp_dir) / bundle.name
+            logger.info(f"Pack {len(bundle.files)} files "
+                        f"into disk:{remote_dir}/{bundle.name}")
+            write_bundle(bundle, local_dir, bundle_path)
+            upload_file(options, bundle_path, f'{remote_dir}/{bundle.name}', algorithms=())
+            bundle_path.unlink()
+
+        # The manifest goes last: it never references missing bundles
+        if plan.transfer or plan.delete:
+            manifest_path = Path(tmp_dir) / MANIFEST_NAME
+            with open_text_write(manifest_path) as file:
+                json.dump(_serialize_manifest(plan.manifest), file)
+            upload_file(options, manifest_path, f'{remote_dir}/{MANIFEST_NAME}', algorithms=())
+
+    if plan.delete:
+        failed = yd_delete_batch(
+            options,
+            [f'{remote_dir}/{name}' for name in plan.delete],
+            permanently=True,
+            threads=threads,
+            executor=executor,
+        )
+        for path in failed:
+            logger.warning(f"Stale bundle disk:{path} has not been deleted")
@@ -0,0 +1,210 @@
+import collections
+import contextlib
+import dataclasses
+import enum
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from yandex_disk_rsync.log import logger
+
+# Counters and stage timers are collected only while a profiler is running
+_enabled = False
+_lock = threading.Lock()
+_stages = threading.local()
+
+
+@dataclasses.dataclass
+class Timer:
+    calls: int = 0
+    seconds: float = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.calls += 1
+        self.seconds += seconds
+
+
+counters: Dict[str, Timer] = collections.defaultdict(Timer)
+stage_timers: Dict[str, Timer] = collections.defaultdict(Timer)
+# Innermost stage of every thread, for the sampling profiler
+_thread_stages: Dict[int, Optional[str]] = {}
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def counted(func: Callable) -> Callable:
+    """
+    Count calls and the time spent in the hot function.
+    Costs a single flag check, while profiling is off
+    """
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with _lock:
+                counters[name].add(elapsed)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """
+    Named part of the run: traversal, listing, hashing, diff, transfer
+    """
+    if not _enabled:
+        yield
+        return
+
+    stack: Optional[List[str]] = getattr(_stages, 'stack', None)
+    if stack is None:
+        stack = _stages.stack = []
+    thread_id = threading.get_ident()
+    stack.append(name)
+    _thread_stages[thread_id] = name
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stack.pop()
+        _thread_stages[thread_id] = stack[-1] if stack else None
+        with _lock:
+            stage_timers[name].add(elapsed)
+
+
+class ProfilerMode(enum.Enum):
+    CProfile = 'cprofile'
+    Sample = 'sample'
+    Both = 'both'
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Sampler(threading.Thread):
+    """
+    Statistical profiler: the stacks of all threads are sampled periodically
+    and counted in the collapsed form (root;...;leaf), rooted at the stage
+    """
+
+    def __init__(self, interval: float = 0.005):
+        super().__init__(name='ydsync-sampler', daemon=True)
+        self.interval = interval
+        self.stacks: Dict[str, int] = collections.Counter()
+        self.samples = 0
+        self.__stop_event = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.__stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(f'stage:{_thread_stages.get(thread_id) or "none"}')
+                self.stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self.__stop_event.set()
+        self.join()
+
+    def write_collapsed(self, file_path: Path) -> None:
+        """
+        Input of flamegraph.pl, speedscope and similar tools
+        """
+        with open(file_path, 'wt', encoding='UTF-8', newline='\n') as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(f'{stack} {count}\n')
+
+
+class Profiler:
+    """
+    Profile the run into <prefix>.pstats (cProfile),
+    <prefix>.collapsed (sampled stacks) and <prefix>.json (stages and counters)
+    """
+
+    def __init__(self, prefix: Path, mode: ProfilerMode = ProfilerMode.Both):
+        self.prefix = prefix
+        self.mode = mode
+        self.__profile: Optional['cProfile.Profile'] = None
+        self.__sampler: Optional[Sampler] = None
+        self.__started = 0.0
+
+    def start(self) -> None:
+        global _enabled
+        counters.clear()
+        stage_timers.clear()
+        _thread_stages.clear()
+        _enabled = True
+
+        if self.mode in {ProfilerMode.Sample, ProfilerMode.Both}:
+            self.__sampler = Sampler()
+            self.__sampler.start()
+        if self.mode in {ProfilerMode.CProfile, ProfilerMode.Both}:
+            import cProfile
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+        self.__started = time.perf_counter()
+
+    def stop(self) -> None:
+        global _enabled
+        elapsed = time.perf_counter() - self.__started
+        if self.__profile is not None:
+            self.__profile.disable()
+        if self.__sampler is not None:
+            self.__sampler.stop()
+        _enabled = False
+
+        self.prefix.parent.mkdir(parents=True, exist_ok=True)
+        if self.__profile is not None:
+            pstats_path = self.prefix.with_name(f'{self.prefix.name}.pstats')
+            self.__profile.dump_stats(str(pstats_path))
+            logger.info(f'cProfile statistics: "{pstats_path}"')
+        if self.__sampler is not None:
+            collapsed_path = self.prefix.with_name(f'{self.prefix.name}.collapsed')
+            self.__sampler.write_collapsed(collapsed_path)
+            logger.info(f'{self.__sampler.samples} stack samples: "{collapsed_path}"')
+
+        summary = {
+            'seconds': elapsed,
+            'stages': {name: dataclasses.asdict(timer) for name, timer in stage_timers.items()},
+            'counters': {name: dataclasses.asdict(timer) for name, timer in counters.items()},
+        }
+        summary_path = self.prefix.with_name(f'{self.prefix.name}.json')
+        with open(summary_path, 'wt', encoding='UTF-8', newline='\n') as file:
+            json.dump(summary, file, indent=2)
+
+        logger.info(f'Profiled {elapsed:.3f} s:')
+        for title, timers in (('stage', stage_timers), ('counter', counters)):
+            for name, timer in sorted(timers.items(), key=lambda pair: -pair[1].seconds):
+                logger.info(f'    {title} {name}: {timer.calls} calls, {timer.seconds:.3f} s')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
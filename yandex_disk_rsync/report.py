@@ -0,0 +1,186 @@
+import dataclasses
+import heapq
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from yandex_disk_rsync.utils import cache_path, \
+    human_readable_size, \
+    lazy_import, \
+    sync_pair_digest
+
+gzip = lazy_import('gzip')
+
+DEFAULT_TOP = 20
+DEFAULT_DEPTH = 1
+# Change lists of the latest runs, kept per sync pair
+KEEP_CHANGE_LISTS = 10
+
+
+def _changes_prefix(local_path, yd_path, shard=None) -> str:
+    prefix = sync_pair_digest(local_path, yd_path)
+    return f'{prefix}-{shard.tag}' if shard is not None else prefix
+
+
+def default_changes_path(local_path, yd_path, shard=None):
+    """
+    Compressed full list of the planned changes, one file per run
+
+    :type local_path: Path
+    :type yd_path: str
+    :type shard: yandex_disk_rsync.shard.ShardSpec | None
+    :rtype: Path
+    """
+    name = f'{_changes_prefix(local_path, yd_path, shard)}-{time.strftime("%Y%m%d-%H%M%S")}'
+    return cache_path() / 'changes' / f'{name}.tsv.gz'
+
+
+def prune_change_lists(local_path, yd_path, shard=None, keep: int = KEEP_CHANGE_LISTS) -> int:
+    """
+    Remove all but the latest change lists of the sync pair
+
+    :type local_path: Path
+    :type yd_path: str
+    :type shard: yandex_disk_rsync.shard.ShardSpec | None
+    :return: Amount of the removed files
+    """
+    prefix = _changes_prefix(local_path, yd_path, shard)
+    # Timestamped names sort chronologically, shard lists have other prefixes
+    paths = sorted((cache_path() / 'changes').glob(f'{prefix}-[0-9]*.tsv.gz'))
+    stale = paths[:max(0, len(paths) - keep)]
+    for file_path in stale:
+        file_path.unlink()
+    return len(stale)
+
+
+@dataclasses.dataclass
+class ChangeTotals:
+    count: int = 0
+    size: int = 0
+
+    def add(self, size) -> None:
+        self.count += 1
+        self.size += size or 0
+
+    def __str__(self):
+        return f'{self.count} items, {human_readable_size(self.size)}'
+
+
+def _directory(relative_path: str, is_dir: bool, depth: int) -> str:
+    parts = relative_path.split('/')
+    if not is_dir:
+        parts = parts[:-1]
+    return '/'.join(parts[:depth]) or '.'
+
+
+class ChangeSummary:
+    """
+    Counts and bytes of the changes per type and per directory,
+    collected in a single pass with the bounded memory for the preview
+    """
+
+    def __init__(self, depth: int = DEFAULT_DEPTH, top: int = DEFAULT_TOP):
+        """
+        :param depth: Directories are aggregated up to this level
+        :param top: Amount of the directories and the largest items to preview
+        """
+        self.depth = depth
+        self.top = top
+        self.by_type: Dict[str, ChangeTotals] = {}
+        self.by_directory: Dict[Tuple[str, str], ChangeTotals] = {}
+        self.__largest: List[Tuple[int, str, str]] = []
+
+    @classmethod
+    def collect(cls, data, depth: int = DEFAULT_DEPTH, top: int = DEFAULT_TOP):
+        """
+        :type data: Iterable[yandex_disk_rsync.SyncData]
+        :rtype: ChangeSummary
+        """
+        summary = cls(depth, top)
+        for item in data:
+            summary.add(item)
+        return summary
+
+    def add(self, item) -> None:
+        """
+        :type item: yandex_disk_rsync.SyncData
+        """
+        sign = item.type.as_one_char()
+        self.by_type.setdefault(sign, ChangeTotals()).add(item.size)
+
+        key = (_directory(item.relative_path, item.is_dir, self.depth), sign)
+        self.by_directory.setdefault(key, ChangeTotals()).add(item.size)
+
+        if self.top <= 0:
+            return
+        suffix = '/' if item.is_dir else ''
+        entry = (item.size or 0, f'{item.relative_path}{suffix}', sign)
+        if len(self.__largest) < self.top:
+            heapq.heappush(self.__largest, entry)
+        elif entry > self.__largest[0]:
+            heapq.heapreplace(self.__largest, entry)
+
+    @property
+    def count(self) -> int:
+        return sum(totals.count for totals in self.by_type.values())
+
+    def largest(self) -> List[Tuple[int, str, str]]:
+        """
+        :return: (size, path, change sign) of the largest items, descending
+        """
+        return sorted(self.__largest, reverse=True)
+
+    def top_directories(self) -> List[Tuple[Tuple[str, str], ChangeTotals]]:
+        return heapq.nlargest(
+            self.top,
+            self.by_directory.items(),
+            key=lambda pair: (pair[1].size, pair[1].count),
+        )
+
+    def print(self, printer: Callable) -> None:
+        if not self.by_type:
+            printer('No changes')
+            return
+
+        for sign, totals in sorted(self.by_type.items()):
+            printer(f'[ {sign} ] {totals}')
+
+        if self.top <= 0:
+            return
+
+        printer(f'Top directories ({len(self.by_directory)} total):')
+        for (directory, sign), totals in self.top_directories():
+            printer(f'    [ {sign} ] {directory}: {totals}')
+
+        printer('Largest items:')
+        for size, path, sign in self.largest():
+            printer(f'    [ {sign} ] {path} ({human_readable_size(size)})')
+
+
+def write_change_list(
+        file_path: Path,
+        changes: Iterable[Tuple[str, Iterable]],
+        conflicts: Iterable[str] = (),
+) -> int:
+    """
+    Stream the full list of changes into a gzip compressed TSV file
+
+    :param changes: (side, SyncData items) pairs
+    :return: Amount of the written lines
+    """
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    with gzip.open(file_path, 'wt', encoding='UTF-8', newline='\n') as file:
+        file.write('side\ttype\tsize\tpath\n')
+        for side, data in changes:
+            for item in data:
+                suffix = '/' if item.is_dir else ''
+                size = '' if item.size is None else item.size
+                file.write(f'{side}\t{item.type.name}\t{size}\t{item.relative_path}{suffix}\n')
+                written += 1
+
+        for path in conflicts:
+            file.write(f'both\tConflict\t\t{path}\n')
+            written += 1
+
+    return written
@@ -0,0 +1,269 @@
+import dataclasses
+import datetime
+import enum
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from yandex_disk_rsync.log import logger
+from yandex_disk_rsync.utils import open_text_read, open_text_write, lazy_import
+
+socket = lazy_import('socket')
+
+
+class ShardBy(enum.Enum):
+    Hash = 'hash'
+    Size = 'size'
+
+
+class ShardStatus(enum.Enum):
+    Running = 'running'
+    Finished = 'finished'
+    Failed = 'failed'
+
+
+@dataclasses.dataclass
+class ShardSpec:
+    index: int
+    count: int
+    by: ShardBy = ShardBy.Hash
+
+    @classmethod
+    def parse(cls, value: str, by: ShardBy = ShardBy.Hash):
+        """
+        :param value: 'I/N', the shard index (from 0) and the shards amount
+        """
+        try:
+            index, count = (int(part) for part in value.split('/'))
+        except ValueError:
+            raise RuntimeError(f'Wrong shard "{value}", expected I/N')
+
+        if count < 1 or not 0 <= index < count:
+            raise RuntimeError(f'Wrong shard "{value}", expected 0 <= I < N')
+
+        return cls(index=index, count=count, by=by)
+
+    @property
+    def tag(self) -> str:
+        """
+        Part of the file names, which belong to the shard
+        """
+        return f'shard-{self.index}-of-{self.count}'
+
+    def __str__(self):
+        return f'{self.index}/{self.count} ({self.by.value})'
+
+
+def hash_shard(key: str, count: int) -> int:
+    return int(hashlib.md5(key.encode('UTF-8')).hexdigest()[:8], 16) % count
+
+
+def size_balanced_assignment(sizes: Dict[str, int], count: int) -> Dict[str, int]:
+    """
+    Greedy assignment of the largest keys to the least loaded shards.
+    Deterministic: every worker computes the same assignment
+    """
+    loads = [0] * count
+    assignment: Dict[str, int] = {}
+    for key in sorted(sizes, key=lambda k: (-sizes[k], k)):
+        shard = min(range(count), key=lambda i: (loads[i], i))
+        assignment[key] = shard
+        loads[shard] += sizes[key]
+    return assignment
+
+
+def local_top_level_sizes(local_path: Path) -> Dict[str, int]:
+    """
+    Sizes of the top level entries, files are not read
+    """
+    sizes: Dict[str, int] = {}
+    with os.scandir(local_path) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                sizes[entry.name] = entry.stat().st_size
+                continue
+
+            total = 0
+            for root, _, files in os.walk(entry.path):
+                for file in files:
+                    try:
+                        total += os.stat(os.path.join(root, file)).st_size
+                    except OSError:
+                        pass
+            sizes[entry.name] = total
+    return sizes
+
+
+def shard_filter(
+        spec: ShardSpec,
+        assignment: Optional[Dict[str, int]] = None,
+) -> Callable[[str], bool]:
+    """
+    Predicate for the top level names, which belong to the shard.
+    Names, unknown to the size-balanced assignment (e.g. missing in local),
+    are sharded by hash
+    """
+    assignment = assignment or {}
+
+    def predicate(name: str) -> bool:
+        shard = assignment.get(name)
+        if shard is None:
+            shard = hash_shard(name, spec.count)
+        return shard == spec.index
+
+    return predicate
+
+
+def top_level_name(relative_path: str) -> str:
+    return relative_path.split('/', 1)[0]
+
+
+def _run_dir(shard_dir: Path, run_id: str) -> Path:
+    return shard_dir / run_id
+
+
+def _report_path(shard_dir: Path, run_id: str, spec: ShardSpec) -> Path:
+    return _run_dir(shard_dir, run_id) / f'{spec.tag}.json'
+
+
+def _assignment_path(shard_dir: Path, run_id: str, yd_path: str) -> Path:
+    # The disk path is the same on every host, unlike the local one
+    key = hashlib.md5(yd_path.encode('UTF-8')).hexdigest()
+    return _run_dir(shard_dir, run_id) / f'assignment-{key}.json'
+
+
+def shared_size_assignment(
+        shard_dir: Path,
+        run_id: str,
+        spec: ShardSpec,
+        local_path: Path,
+        yd_path: str,
+) -> Dict[str, int]:
+    """
+    The size-balanced assignment of the run, computed once.
+    The first worker scans its local tree and publishes the assignment
+    into the shared directory, the rest of workers read it,
+    so the shards never overlap even if the trees differ
+    """
+    file_path = _assignment_path(shard_dir, run_id, yd_path)
+    if not file_path.exists():
+        sizes = local_top_level_sizes(local_path) if local_path.is_dir() else {}
+        tmp_path = file_path.with_name(f'{file_path.name}.{os.getpid()}.tmp')
+        _write_json(tmp_path, {
+            'count': spec.count,
+            'host': socket.gethostname(),
+            'assignment': size_balanced_assignment(sizes, spec.count),
+        })
+        try:
+            # Fails, if another worker has published its assignment first
+            os.link(tmp_path, file_path)
+            logger.info(f'Published the shard assignment "{file_path}"')
+        except FileExistsError:
+            pass
+        finally:
+            tmp_path.unlink()
+
+    with open_text_read(file_path) as file:
+        data = json.load(file)
+    if data['count'] != spec.count:
+        raise RuntimeError(f'The shard assignment "{file_path}" is for '
+                           f'{data["count"]} shards, not {spec.count}')
+    return data['assignment']
+
+
+def _write_json(file_path: Path, data: dict) -> None:
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(f'{file_path.name}.{os.getpid()}.tmp')
+    with open_text_write(tmp_path) as file:
+        json.dump(data, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def write_shard_report(
+        shard_dir: Path,
+        run_id: str,
+        spec: ShardSpec,
+        status: ShardStatus,
+        jobs: Optional[List[dict]] = None,
+) -> None:
+    """
+    The partial report of the worker, written into the shared directory
+    """
+    _write_json(_report_path(shard_dir, run_id, spec), {
+        'index': spec.index,
+        'count': spec.count,
+        'by': spec.by.value,
+        'status': status.value,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'updated': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'jobs': jobs or [],
+    })
+
+
+@dataclasses.dataclass
+class MergedReport:
+    count: int
+    finished: List[int]
+    # Shard index to its status (running, failed or missing)
+    unfinished: Dict[int, str]
+    changes: Dict[str, int]
+
+    @property
+    def complete(self) -> bool:
+        return not self.unfinished
+
+
+def merge_shard_reports(shard_dir: Path, run_id: str) -> MergedReport:
+    """
+    Merge partial reports, the result is written as merged.json
+    """
+    run_dir = _run_dir(shard_dir, run_id)
+    reports = {}
+    for report_path in sorted(run_dir.glob('shard-*-of-*.json')):
+        with open_text_read(report_path) as file:
+            report = json.load(file)
+        reports[(report['index'], report['count'])] = report
+
+    counts = {count for _, count in reports}
+    if not counts:
+        raise RuntimeError(f'No shard reports in "{run_dir}"')
+    if len(counts) > 1:
+        raise RuntimeError(f'Shard reports in "{run_dir}" '
+                           f'have different shards amount: {sorted(counts)}')
+    count = counts.pop()
+
+    finished: List[int] = []
+    unfinished: Dict[int, str] = {}
+    changes: Dict[str, int] = {}
+    for index in range(count):
+        report = reports.get((index, count))
+        if report is None:
+            unfinished[index] = 'missing'
+            continue
+        if report['status'] != ShardStatus.Finished.value:
+            unfinished[index] = f"{report['status']} on {report['host']}"
+            continue
+
+        finished.append(index)
+        for job in report['jobs']:
+            for key, value in job['changes'].items():
+                changes[key] = changes.get(key, 0) + value
+
+    merged = MergedReport(
+        count=count,
+        finished=finished,
+        unfinished=unfinished,
+        changes=changes,
+    )
+    _write_json(run_dir / 'merged.json', dataclasses.asdict(merged))
+
+    logger.info(f'Finished {len(finished)} of {count} shards')
+    for index, status in unfinished.items():
+        logger.error(f'Shard {index}/{count} is not finished: {status}')
+
+    return merged
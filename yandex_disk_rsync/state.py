@@ -0,0 +1,173 @@
+import dataclasses
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from yandex_disk_rsync.data import FileBriefData
+from yandex_disk_rsync.log import logger
+from yandex_disk_rsync.utils import cache_path, \
+    open_text_read, \
+    open_text_write, \
+    sync_pair_digest
+
+STATE_VERSION = 1
+
+
+def default_state_path(local_path, yd_path):
+    """
+    State file location for the local and the disk paths pair
+
+    :type local_path: Path
+    :type yd_path: str
+    :rtype: Path
+    """
+    return cache_path() / 'state' / f'{sync_pair_digest(local_path, yd_path)}.json'
+
+
+def shard_state_path(state_path, shard):
+    """
+    Shards of one tree have separate state files,
+    concurrent workers never replace the state of each other
+
+    :type state_path: Path
+    :type shard: yandex_disk_rsync.shard.ShardSpec
+    :rtype: Path
+    """
+    return state_path.with_name(f'{state_path.stem}-{shard.tag}{state_path.suffix}')
+
+
+def shard_state_paths(state_path):
+    """
+    State files of all shards of the tree, the oldest first
+
+    :type state_path: Path
+    :rtype: List[Path]
+    """
+    return sorted(
+        state_path.parent.glob(f'{state_path.stem}-shard-*-of-*{state_path.suffix}'),
+        key=lambda file_path: file_path.stat().st_mtime,
+    )
+
+
+def pending_state_path(state_path):
+    """
+    The state after the planned sync, it replaces the state on completion
+
+    :type state_path: Path
+    :rtype: Path
+    """
+    return state_path.with_name(f'{state_path.name}.pending')
+
+
+@dataclasses.dataclass
+class SyncState:
+    """
+    Last synchronized state, the common base for the two-way synchronization
+    """
+    files: Dict[str, FileBriefData] = dataclasses.field(default_factory=dict)
+    # Completion time of the sync, None for the pending state
+    synced_at: Optional[float] = None
+
+    __KEY_VERSION = 'version'
+    __KEY_FILES = 'files'
+    __KEY_SYNCED_AT = 'synced_at'
+
+    def serialize(self):
+        """
+        :rtype: dict
+        """
+        return {
+            self.__KEY_VERSION: STATE_VERSION,
+            self.__KEY_SYNCED_AT: self.synced_at,
+            self.__KEY_FILES: {
+                path: {
+                    'md5': item.md5,
+                    'size': item.size,
+                    'mtime': item.mtime,
+                    'sha256': item.sha256,
+                }
+                for path, item in self.files.items()
+            },
+        }
+
+    @classmethod
+    def deserialize(cls, data):
+        """
+        :type data: dict
+        :rtype: SyncState
+        """
+        if data.get(cls.__KEY_VERSION) != STATE_VERSION:
+            logger.warning("Unsupported sync state version, ignoring it")
+            return cls()
+
+        return cls(
+            files={
+                path: FileBriefData(
+                    path=path,
+                    md5=item['md5'],
+                    size=item.get('size'),
+                    mtime=item.get('mtime'),
+                    sha256=item.get('sha256'),
+                )
+                for path, item in data[cls.__KEY_FILES].items()
+            },
+            synced_at=data.get(cls.__KEY_SYNCED_AT),
+        )
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Empty state is returned, if there is no state file
+
+        :type file_path: Path
+        :rtype: SyncState
+        """
+        if not file_path.exists():
+            logger.info(f'No sync state "{file_path}", starting from scratch')
+            return cls()
+
+        with open_text_read(file_path) as file:
+            return cls.deserialize(json.load(file))
+
+    def save(self, file_path):
+        """
+        Atomically replace the state file
+
+        :type file_path: Path
+        """
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = file_path.with_name(file_path.name + '.tmp')
+        with open_text_write(tmp_path) as file:
+            json.dump(self.serialize(), file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmp_path, file_path)
+        logger.info(f'Saved sync state of {len(self.files)} files '
+                    f'into "{file_path}"')
+
+    @classmethod
+    def commit(cls, state_path, uploaded=None):
+        """
+        Replace the state with the pending one after all transfers,
+        stamping the completion time
+
+        :type state_path: Path
+        :param uploaded: Digests of the uploaded files,
+            new files are not hashed before the upload
+        :type uploaded: Dict[str, yandex_disk_rsync.hashing.Digests] | None
+        """
+        pending_path = pending_state_path(state_path)
+        state = cls.load(pending_path)
+        for path, digests in (uploaded or {}).items():
+            if path in state.files:
+                state.files[path] = dataclasses.replace(
+                    state.files[path],
+                    md5=digests.md5 or state.files[path].md5,
+                    sha256=digests.sha256 or state.files[path].sha256,
+                    size=digests.size,
+                )
+        state.synced_at = time.time()
+        state.save(state_path)
+        pending_path.unlink()
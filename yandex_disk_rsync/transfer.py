@@ -0,0 +1,253 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from yandex_disk_rsync.hash_cache import HashCache
+from yandex_disk_rsync.hashing import StreamHasher, Digests, DEFAULT_BUFFER_SIZE, file_digests
+from yandex_disk_rsync.log import logger
+from yandex_disk_rsync.profiling import counted
+from yandex_disk_rsync.utils import is_enabled, lazy_import, ydcmd
+
+requests = lazy_import('requests')
+
+# Suffix of the partial downloads, they are never synchronized
+PART_SUFFIX = '.ydsync-part'
+
+# Default pool_maxsize of requests
+DEFAULT_POOL_SIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+_pool_size = DEFAULT_POOL_SIZE
+
+
+def _mount_adapter(session, pool_size: int) -> None:
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+def http_session():
+    """
+    Process-wide HTTP session: connections are reused by all transfers
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _mount_adapter(_session, _pool_size)
+        return _session
+
+
+def set_http_pool_size(threads: int) -> None:
+    """
+    Keep a connection per concurrent request (and the main thread),
+    the connections above the pool size are dropped instead of being reused
+    """
+    global _pool_size
+    with _session_lock:
+        _pool_size = max(DEFAULT_POOL_SIZE, threads + 1)
+        if _session is not None:
+            _mount_adapter(_session, _pool_size)
+
+
+def _request_kwargs(options) -> dict:
+    cafile = getattr(options, 'cafile', None)
+    return {
+        'headers': {'Authorization': f'OAuth {options.token}'},
+        'timeout': options.timeout,
+        'verify': cafile if cafile else True,
+    }
+
+
+def api_query(options, method: str, url: str, args: dict) -> Optional[dict]:
+    """
+    Disk API request through the shared session, in place of ydcmd.yd_query_retry.
+    Connection errors and 5xx/429 responses are retried,
+    other unsuccessful responses raise ydcmd.ydError with the HTTP status
+
+    :return: Response JSON or None, if the response is empty
+    """
+    def query():
+        response = http_session().request(
+            method,
+            url,
+            params=args,
+            **_request_kwargs(options),
+        )
+        if response.status_code >= 500 or response.status_code == 429:
+            response.raise_for_status()
+        return response
+
+    try:
+        response = _with_retries(options, f"{method} {url}", query)
+    except requests.HTTPError as e:
+        raise ydcmd.ydError(e.response.status_code, str(e))
+
+    if response.status_code >= 400:
+        try:
+            message = response.json().get('description') or response.text
+        except ValueError:
+            message = response.text
+        raise ydcmd.ydError(response.status_code, message)
+
+    if not response.content:
+        return None
+    return response.json()
+
+
+def ydcmd_transfers(options) -> bool:
+    """
+    The encryption is implemented by ydcmd only,
+    such transfers go through yd_get and yd_put
+    """
+    return is_enabled(getattr(options, 'encrypt', False)) \
+        or is_enabled(getattr(options, 'decrypt', False))
+
+
+def _transfer_link(options, method: str, remote_path: str) -> str:
+    args = {'path': remote_path}
+    if method == 'upload':
+        args['overwrite'] = 'true'
+
+    result = api_query(
+        options,
+        'GET',
+        f'{options.baseurl}/resources/{method}',
+        args,
+    )
+    return result['href']
+
+
+def _with_retries(options, description: str, func):
+    for attempt in range(options.retries + 1):
+        try:
+            return func()
+        except (requests.RequestException, OSError) as e:
+            if attempt >= options.retries:
+                raise
+            logger.warning(f"{description} failed ({e}), retrying")
+            time.sleep(options.delay)
+
+
+class _HashingReader:
+    """
+    Upload body, which hashes the file bytes while they are sent
+    """
+
+    def __init__(self, file_path: Path, hasher: StreamHasher):
+        self.__file_path = file_path
+        self.__hasher = hasher
+        self.__size = os.stat(file_path).st_size
+
+    def __len__(self):
+        return self.__size
+
+    def __iter__(self):
+        with open(self.__file_path, 'rb') as file:
+            while True:
+                chunk = file.read(DEFAULT_BUFFER_SIZE)
+                if not chunk:
+                    break
+                self.__hasher.update(chunk)
+                yield chunk
+
+
+@counted
+def download_file(
+        options,
+        remote_path: str,
+        local_path: Path,
+        expected_md5: Optional[str] = None,
+        hash_cache: Optional[HashCache] = None,
+        algorithms: Iterable[str] = ('md5',),
+) -> Digests:
+    """
+    Download the file, hashing the received bytes.
+    The file is verified against the remote md5 and recorded into the cache
+
+    :param algorithms: Digests to compute, md5 is added for the verification
+    """
+    algorithms = {*algorithms, 'md5'} if expected_md5 else set(algorithms)
+    if ydcmd_transfers(options):
+        # The disk md5 is the digest of the encrypted content
+        ydcmd.yd_get(options, remote_path, str(local_path))
+        digests = file_digests(local_path, algorithms)
+        if hash_cache is not None:
+            hash_cache.put(local_path, os.stat(local_path), digests)
+        return digests
+
+    tmp_path = local_path.with_name(f'.{local_path.name}{PART_SUFFIX}')
+
+    def download():
+        hasher = StreamHasher(algorithms)
+        link = _transfer_link(options, 'download', remote_path)
+        with http_session().get(link, stream=True, **_request_kwargs(options)) as response:
+            response.raise_for_status()
+            with open(tmp_path, 'wb') as file:
+                for chunk in response.iter_content(DEFAULT_BUFFER_SIZE):
+                    hasher.update(chunk)
+                    file.write(chunk)
+        return hasher.digests()
+
+    try:
+        digests = _with_retries(options, f"Download of disk:{remote_path}", download)
+        if expected_md5 and digests.md5 != expected_md5:
+            raise RuntimeError(f"Checksum mismatch for disk:{remote_path}: "
+                               f"expected {expected_md5}, got {digests.md5}")
+        os.replace(tmp_path, local_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    if hash_cache is not None:
+        hash_cache.put(local_path, os.stat(local_path), digests)
+    return digests
+
+
+@counted
+def upload_file(
+        options,
+        local_path: Path,
+        remote_path: str,
+        expected_md5: Optional[str] = None,
+        hash_cache: Optional[HashCache] = None,
+        algorithms: Iterable[str] = ('md5',),
+) -> Digests:
+    """
+    Upload the file, hashing the sent bytes.
+    The digests of the uploaded content are recorded into the cache,
+    new files are not hashed before the upload
+
+    :param algorithms: Digests to compute
+    """
+    if ydcmd_transfers(options):
+        stat = os.stat(local_path)
+        digests = file_digests(local_path, algorithms)
+        ydcmd.yd_put(options, str(local_path), remote_path)
+        if hash_cache is not None:
+            hash_cache.put(local_path, stat, digests)
+        return digests
+
+    def upload():
+        hasher = StreamHasher(algorithms)
+        stat = os.stat(local_path)
+        link = _transfer_link(options, 'upload', remote_path)
+        response = http_session().put(
+            link,
+            data=_HashingReader(local_path, hasher),
+            **_request_kwargs(options),
+        )
+        response.raise_for_status()
+        return stat, hasher.digests()
+
+    stat, digests = _with_retries(options, f"Upload of {local_path}", upload)
+    if expected_md5 and digests.md5 != expected_md5:
+        logger.warning(f"{local_path} has been changed during the sync, "
+                       f"uploaded content md5 is {digests.md5}")
+
+    if hash_cache is not None and os.stat(local_path).st_mtime_ns == stat.st_mtime_ns:
+        hash_cache.put(local_path, stat, digests)
+    return digests
@@ -1,7 +1,40 @@
 import hashlib
+import importlib
+import os
+import types
 from pathlib import Path
 
-from yandex_disk_rsync import ydcmd
+from yandex_disk_rsync.hashing import file_digests
+from yandex_disk_rsync.profiling import counted
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module proxy, which imports the real module on the first attribute access.
+    Keeps heavy dependencies (ydcmd, requests, yaml) out of the CLI startup
+    """
+
+    def __init__(self, name):
+        """
+        :type name: str
+        """
+        super().__init__(name)
+
+    def __getattr__(self, item):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, item)
+
+
+def lazy_import(name):
+    """
+    :type name: str
+    :rtype: types.ModuleType
+    """
+    return LazyModule(name)
+
+
+ydcmd = lazy_import('yandex_disk_rsync.ydcmd')
 
 
 def open_text_read(filename):
@@ -25,22 +58,42 @@ def runtime_path() -> Path:
     return Path('.')
 
 
+def cache_path() -> Path:
+    """
+    Directory for the application state (sync base, caches)
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or '~/.cache'
+    return Path(cache_home).expanduser() / 'yandex_disk_rsync'
+
+
+def sync_pair_digest(local_path, yd_path) -> str:
+    """
+    Identifier of the local and the disk paths pair
+
+    :type local_path: Path
+    :type yd_path: str
+    """
+    key = f'{Path(local_path).resolve().as_posix()}\n{yd_path}'
+    return hashlib.md5(key.encode('UTF-8')).hexdigest()
+
+
 def human_readable_size(size: int) -> str:
     return ydcmd.yd_human(size)
 
 
+@counted
 def file_md5(fname):
     """
-    https://stackoverflow.com/a/3431838/14142236
-
     :type fname: str | Path
     """
-    buffer_size = 4096 * 4
-    hash_md5 = hashlib.md5()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(buffer_size), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    return file_digests(fname, ('md5',)).md5
+
+
+def is_enabled(value) -> bool:
+    """
+    ydcmd flags are booleans or strings like 'yes'
+    """
+    return str(value).strip().lower() in {'1', 'true', 'yes', 'on'}
 
 
 def ask_to_continue() -> None:
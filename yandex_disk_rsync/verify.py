@@ -0,0 +1,390 @@
+import bisect
+import dataclasses
+import enum
+import json
+import math
+import os
+import random
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from yandex_disk_rsync.config import SyncConfig
+from yandex_disk_rsync.data import FileBriefData, Checksum, same_content, yd_file_brief
+from yandex_disk_rsync.hash_cache import HashCache
+from yandex_disk_rsync.hashing import file_digests
+from yandex_disk_rsync.log import logger
+from yandex_disk_rsync.pack import PACK_DIR_NAME
+from yandex_disk_rsync.state import SyncState, \
+    default_state_path, \
+    shard_state_paths
+from yandex_disk_rsync.transfer import PART_SUFFIX
+from yandex_disk_rsync.utils import cache_path, \
+    human_readable_size, \
+    open_text_read, \
+    open_text_write, \
+    sync_pair_digest, \
+    ydcmd
+
+
+class VerifyMode(enum.Enum):
+    # Walk the sorted files, continuing after the last checked one
+    Rotating = 'rotating'
+    Random = 'random'
+
+
+class FindingKind(enum.Enum):
+    # Unmodified since the last sync, but the content differs
+    LocalCorrupted = 'local_corrupted'
+    RemoteMismatch = 'remote_mismatch'
+    RemoteMissing = 'remote_missing'
+    # Not in the sync state, local and disk files differ
+    ContentMismatch = 'content_mismatch'
+
+
+class RepairAction(enum.Enum):
+    Download = 'download'
+    Upload = 'upload'
+    Manual = 'manual'
+
+
+@dataclasses.dataclass
+class Finding:
+    path: str
+    kind: FindingKind
+    repair: RepairAction
+    detail: str
+
+    def serialize(self):
+        """
+        :rtype: dict
+        """
+        return {
+            'path': self.path,
+            'kind': self.kind.value,
+            'repair': self.repair.value,
+            'detail': self.detail,
+        }
+
+
+@dataclasses.dataclass
+class VerifyReport:
+    name: str
+    local_path: Path
+    yd_path: str
+    mode: VerifyMode
+    candidates: int = 0
+    checked: int = 0
+    # Changed after the last sync, nothing to verify against
+    pending: int = 0
+    bytes_read: int = 0
+    seconds: float = 0.0
+    budget_exhausted: bool = False
+    findings: List[Finding] = dataclasses.field(default_factory=list)
+    error: Optional[str] = None
+
+    def serialize(self):
+        """
+        :rtype: dict
+        """
+        return {
+            'name': self.name,
+            'local_path': str(self.local_path),
+            'yd_path': self.yd_path,
+            'mode': self.mode.value,
+            'candidates': self.candidates,
+            'checked': self.checked,
+            'pending': self.pending,
+            'bytes_read': self.bytes_read,
+            'seconds': self.seconds,
+            'budget_exhausted': self.budget_exhausted,
+            'findings': [finding.serialize() for finding in self.findings],
+            'error': self.error,
+        }
+
+    def __str__(self):
+        status = 'OK' if not self.findings and not self.error else \
+            f'FAILED ({self.error})' if self.error else \
+            f'{len(self.findings)} findings'
+        return (f'{self.name}: {status}; checked {self.checked} of {self.candidates} files, '
+                f'{human_readable_size(self.bytes_read)} in {self.seconds:.1f} s, '
+                f'{self.pending} pending changes'
+                + (', budget exhausted' if self.budget_exhausted else ''))
+
+
+def default_cursor_path(local_path, yd_path):
+    """
+    :type local_path: Path
+    :type yd_path: str
+    :rtype: Path
+    """
+    return cache_path() / 'verify' / f'{sync_pair_digest(local_path, yd_path)}.cursor'
+
+
+def default_verify_report_path():
+    """
+    :rtype: Path
+    """
+    return cache_path() / 'verify' / f'report-{time.strftime("%Y%m%d-%H%M%S")}.json'
+
+
+def verify_candidates(
+        local_path: Path,
+        index: Dict[str, FileBriefData],
+        excluded: List[str],
+) -> List[str]:
+    """
+    Sorted relative paths of the local and the synchronized files
+
+    :param excluded: Subtrees to skip, e.g. the packed ones
+    """
+    paths = set(index)
+    for root, dirs, files in os.walk(local_path):
+        relative_root = Path(root).relative_to(local_path).as_posix()
+        for name in files:
+            if name.endswith(PART_SUFFIX):
+                continue
+            paths.add(name if relative_root == '.' else f'{relative_root}/{name}')
+
+    prefixes = tuple(f'{subtree}/' for subtree in excluded)
+    return sorted(
+        path
+        for path in paths
+        if not path.startswith(prefixes) and PACK_DIR_NAME not in path.split('/')
+    )
+
+
+def select_sample(
+        candidates: List[str],
+        mode: VerifyMode,
+        count: int,
+        cursor: Optional[str] = None,
+) -> List[str]:
+    """
+    :param candidates: Sorted paths
+    :param cursor: The last path, checked by the previous rotating run
+    """
+    count = min(count, len(candidates))
+    if mode == VerifyMode.Random:
+        return random.sample(candidates, count)
+
+    start = bisect.bisect_right(candidates, cursor) if cursor else 0
+    return [
+        candidates[(start + i) % len(candidates)]
+        for i in range(count)
+    ]
+
+
+def load_cursor(file_path: Path) -> Optional[str]:
+    if not file_path.exists():
+        return None
+    with open_text_read(file_path) as file:
+        return json.load(file).get('cursor')
+
+
+def save_cursor(file_path: Path, cursor: str) -> None:
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open_text_write(file_path) as file:
+        json.dump({'cursor': cursor}, file)
+
+
+def verify_file(
+        options,
+        relative_path: str,
+        local_root_path: Path,
+        remote_root_path: str,
+        index_item: Optional[FileBriefData],
+        synced_at: Optional[float],
+        checksum: Checksum,
+        report: VerifyReport,
+        hash_cache: Optional[HashCache] = None,
+) -> None:
+    """
+    Compare the fresh local read with the hash cache and the sync state,
+    the disk digests with the sync state
+    """
+    local_path = local_root_path / relative_path
+    local_item = None
+    # The content the local file should have, if it is corrupted
+    expected_item = index_item
+    local_synced = False
+    if local_path.is_file():
+        stat = os.stat(local_path)
+        cached = hash_cache.get(local_path, stat, checksum.algorithms()) \
+            if hash_cache is not None \
+            else None
+        digests = file_digests(local_path, checksum.algorithms())
+        report.bytes_read += digests.size
+        if hash_cache is not None and cached is None:
+            hash_cache.put(local_path, stat, digests)
+
+        local_item = FileBriefData(
+            path=relative_path,
+            md5=digests.md5,
+            size=digests.size,
+            sha256=digests.sha256,
+        )
+        local_synced = synced_at is not None and stat.st_mtime <= synced_at
+
+        # size and mtime are unchanged, the content must be the same
+        if cached is not None and not same_content(cached, local_item, checksum):
+            expected_item = cached
+        elif index_item is None or not local_synced \
+                or same_content(index_item, local_item, checksum):
+            expected_item = None
+
+    remote_item = yd_file_brief(options, f'{remote_root_path}/{relative_path}')
+    remote_synced = remote_item is not None and synced_at is not None \
+        and (remote_item.mtime is None or remote_item.mtime <= synced_at)
+    if (local_item is not None and not local_synced) \
+            or (remote_item is not None and not remote_synced):
+        report.pending += 1
+
+    def add(kind: FindingKind, repair: RepairAction, detail: str):
+        logger.warning(f'[ ! ] {relative_path}: {kind.value}, {detail}')
+        report.findings.append(Finding(relative_path, kind, repair, detail))
+
+    if local_item is not None and expected_item is not None:
+        remote_is_expected = remote_item is not None \
+            and same_content(expected_item, remote_item, checksum)
+        add(
+            FindingKind.LocalCorrupted,
+            RepairAction.Download if remote_is_expected else RepairAction.Manual,
+            f'expected md5 {expected_item.md5}, read {local_item.md5}',
+        )
+
+    local_is_indexed = local_item is not None and index_item is not None \
+        and local_synced and same_content(index_item, local_item, checksum)
+    if index_item is not None:
+        if remote_item is None:
+            add(
+                FindingKind.RemoteMissing,
+                RepairAction.Upload if local_is_indexed else RepairAction.Manual,
+                'the synchronized file is missing on the disk',
+            )
+        elif remote_synced and not same_content(index_item, remote_item, checksum):
+            add(
+                FindingKind.RemoteMismatch,
+                RepairAction.Upload if local_is_indexed else RepairAction.Manual,
+                f'expected md5 {index_item.md5}, disk has {remote_item.md5}',
+            )
+    elif local_item is not None and remote_item is not None \
+            and local_synced and remote_synced \
+            and not same_content(local_item, remote_item, checksum):
+        add(
+            FindingKind.ContentMismatch,
+            RepairAction.Manual,
+            f'local md5 {local_item.md5}, disk has {remote_item.md5}',
+        )
+
+
+def verify_job(
+        options,
+        name: str,
+        local_path: Path,
+        yd_path: str,
+        sync: SyncConfig,
+        hash_cache: Optional[HashCache] = None,
+) -> VerifyReport:
+    """
+    Verify the sample of files within the I/O and time budgets.
+    A rotating cycle covers all files in verify_cycle_days runs
+    """
+    started = time.monotonic()
+    mode = VerifyMode(sync.verify_mode)
+    checksum = Checksum.Sha256 if sync.checksum == Checksum.Sha256.value else Checksum.Md5
+    report = VerifyReport(name=name, local_path=local_path, yd_path=yd_path, mode=mode)
+
+    state_path = sync.state_path or default_state_path(local_path, yd_path)
+    # Sharded runs keep the state per shard, the latest one wins
+    index: Dict[str, FileBriefData] = {}
+    synced_at: Dict[str, float] = {}
+    last_synced_at = None
+    for file_path in [state_path, *shard_state_paths(state_path)]:
+        if not file_path.exists():
+            continue
+        state = SyncState.load(file_path)
+        # States, saved before the completion time was stored
+        last_synced_at = state.synced_at or file_path.stat().st_mtime
+        index.update(state.files)
+        synced_at.update(dict.fromkeys(state.files, last_synced_at))
+
+    candidates = verify_candidates(local_path, index, sync.pack)
+    report.candidates = len(candidates)
+    count = math.ceil(len(candidates) / sync.verify_cycle_days) \
+        if sync.verify_cycle_days > 0 \
+        else len(candidates)
+
+    cursor_path = default_cursor_path(local_path, yd_path)
+    sample = select_sample(candidates, mode, count, load_cursor(cursor_path))
+    logger.info(f'Verifying {len(sample)} of {len(candidates)} files ({mode.value})')
+
+    last_checked = None
+    for relative_path in sample:
+        elapsed = time.monotonic() - started
+        file_path = local_path / relative_path
+        size = os.stat(file_path).st_size if file_path.is_file() else 0
+        if report.checked and (
+                (sync.verify_max_seconds is not None and elapsed >= sync.verify_max_seconds)
+                or (sync.verify_max_bytes is not None
+                    and report.bytes_read + size > sync.verify_max_bytes)
+        ):
+            report.budget_exhausted = True
+            break
+
+        try:
+            verify_file(
+                options,
+                relative_path,
+                local_path,
+                yd_path,
+                index.get(relative_path),
+                synced_at.get(relative_path, last_synced_at),
+                checksum,
+                report,
+                hash_cache=hash_cache,
+            )
+        except ydcmd.ydError as e:
+            # Not a finding: the disk is unavailable, e.g. the token is expired
+            logger.error(f'Unable to verify {relative_path}: {e}')
+            report.error = f'{relative_path}: {e}'
+            break
+        report.checked += 1
+        last_checked = relative_path
+
+    if mode == VerifyMode.Rotating and last_checked is not None:
+        save_cursor(cursor_path, last_checked)
+
+    report.seconds = time.monotonic() - started
+    return report
+
+
+def write_verify_report(file_path: Path, reports: List[VerifyReport]) -> None:
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open_text_write(file_path) as file:
+        json.dump({'jobs': [report.serialize() for report in reports]}, file, indent=2)
+
+
+def write_repair_plan(file_path: Path, reports: List[VerifyReport]) -> int:
+    """
+    Actions to fix the findings, grouped by the sync pair
+
+    :return: Amount of the planned actions
+    """
+    jobs = [
+        {
+            'name': report.name,
+            'local_path': str(report.local_path),
+            'yd_path': report.yd_path,
+            'operations': [
+                {'path': finding.path, 'action': finding.repair.value}
+                for finding in report.findings
+            ],
+        }
+        for report in reports
+        if report.findings
+    ]
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open_text_write(file_path) as file:
+        json.dump({'jobs': jobs}, file, indent=2)
+    return sum(len(job['operations']) for job in jobs)